@@ -1,18 +1,427 @@
 import sqlite3
 import datetime
-import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from project_import import normalize_project
+from search_query import STATUS_VALUES, compile_search
+
+
+# --- Formato de armazenamento ---
+# Dinheiro de 'projetos' e 'resumo_mensal' em centavos (INTEGER), data_atualizacao e horários do
+# histórico em segundos desde a época (INTEGER) e data_entrega como AAAA-MM-DD. Somas e comparações
+# ficam em inteiros; quem usa Database recebe float, datetime e date por estes adaptadores.
+def to_cents(valor):
+    return None if valor is None else round(float(valor) * 100)
+
+
+def from_cents(centavos):
+    return None if centavos is None else centavos / 100
+
+
+def to_epoch(momento):
+    # datetime sem fuso = hora local, como o resto do app
+    return None if momento is None else int(momento.timestamp())
+
+
+def from_epoch(segundos):
+    return None if segundos is None else datetime.datetime.fromtimestamp(segundos)
+
+
+def to_iso_date(data):
+    return data.strftime("%Y-%m-%d") if data else None
+
+
+def from_iso_date(texto):
+    return datetime.date.fromisoformat(texto) if texto else None
+
+
+# --- Resumo mensal (rollup) ---
+# Chave do resumo para uma linha de 'projetos' (ref = NEW, OLD ou alias). NULL vira '' porque
+# NULLs não colidem na chave primária; as leituras desfazem isso com NULLIF.
+def _rollup_key_sql(ref):
+    return (f"CAST(substr({ref}.data_criacao, 1, 4) AS INTEGER), CAST(substr({ref}.data_criacao, 6, 2) AS INTEGER), "
+            f"IFNULL({ref}.categoria, ''), IFNULL({ref}.status, '')")
+
+
+def _rollup_upsert_sql(ref, sinal):
+    # Soma (sinal '+') ou retira (sinal '-') a contribuição de um projeto do seu balde
+    return f"""
+        INSERT INTO resumo_mensal (ano, mes, categoria, status, qtd_projetos, receita, horas)
+        SELECT {_rollup_key_sql(ref)}, {sinal}1, {sinal}IFNULL({ref}.preco_final, 0), {sinal}IFNULL({ref}.horas_totais, 0)
+        WHERE {ref}.data_criacao IS NOT NULL
+        ON CONFLICT (ano, mes, categoria, status) DO UPDATE SET
+            qtd_projetos = qtd_projetos + excluded.qtd_projetos,
+            receita = receita + excluded.receita,
+            horas = horas + excluded.horas;"""
+
+
+def _rollup_merge_sql(where):
+    # Soma no resumo os projetos que casam com 'where' (agrupados), sem passar pelos triggers
+    return f"""
+        INSERT INTO resumo_mensal (ano, mes, categoria, status, qtd_projetos, receita, horas)
+        SELECT {_rollup_key_sql('p')}, COUNT(*), IFNULL(SUM(p.preco_final), 0), TOTAL(p.horas_totais)
+        FROM projetos p
+        WHERE p.data_criacao IS NOT NULL AND {where}
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (ano, mes, categoria, status) DO UPDATE SET
+            qtd_projetos = qtd_projetos + excluded.qtd_projetos,
+            receita = receita + excluded.receita,
+            horas = horas + excluded.horas"""
+
+
+def _rollup_cleanup_sql(ref):
+    return f"""
+        DELETE FROM resumo_mensal
+        WHERE qtd_projetos <= 0 AND (ano, mes, categoria, status) = ({_rollup_key_sql(ref)});"""
+
+
+def _horas_tarefa_sql(ref, sinal):
+    # Mantém projetos.horas_totais; o trigger de UPDATE em 'projetos' repassa a diferença ao resumo
+    return f"""
+        UPDATE projetos SET horas_totais = IFNULL(horas_totais, 0) {sinal} IFNULL({ref}.horas_estimadas, 0)
+        WHERE id = {ref}.projeto_id;"""
+
+
+ROLLUP_TRIGGERS = {
+    "trg_resumo_projeto_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_resumo_projeto_insert AFTER INSERT ON projetos
+        BEGIN {_rollup_upsert_sql('NEW', '+')}
+        END""",
+    "trg_resumo_projeto_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_resumo_projeto_delete AFTER DELETE ON projetos
+        BEGIN {_rollup_upsert_sql('OLD', '-')} {_rollup_cleanup_sql('OLD')}
+        END""",
+    "trg_resumo_projeto_update": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_resumo_projeto_update
+        AFTER UPDATE OF data_criacao, categoria, status, preco_final, horas_totais ON projetos
+        BEGIN {_rollup_upsert_sql('OLD', '-')} {_rollup_cleanup_sql('OLD')} {_rollup_upsert_sql('NEW', '+')}
+        END""",
+}
+
+HORAS_TRIGGERS = {
+    "trg_horas_tarefa_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_horas_tarefa_insert AFTER INSERT ON tarefas_projeto
+        BEGIN {_horas_tarefa_sql('NEW', '+')}
+        END""",
+    "trg_horas_tarefa_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_horas_tarefa_delete AFTER DELETE ON tarefas_projeto
+        BEGIN {_horas_tarefa_sql('OLD', '-')}
+        END""",
+    "trg_horas_tarefa_update": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_horas_tarefa_update
+        AFTER UPDATE OF projeto_id, horas_estimadas ON tarefas_projeto
+        BEGIN {_horas_tarefa_sql('OLD', '-')} {_horas_tarefa_sql('NEW', '+')}
+        END""",
+}
+
+
+# --- Busca textual (FTS5) ---
+# Uma linha por projeto (rowid = projetos.id), com as descrições das tarefas concatenadas.
+def _fts_insert_sql(where):
+    return f"""
+        INSERT INTO projetos_fts (rowid, cliente, categoria, desconto_texto, tarefas)
+        SELECT p.id, p.cliente, p.categoria, p.desconto_texto,
+               (SELECT group_concat(descricao, ' ') FROM tarefas_projeto WHERE projeto_id = p.id)
+        FROM projetos p WHERE {where};"""
+
+
+def _fts_refresh_sql(projeto_ref):
+    return f"""
+        DELETE FROM projetos_fts WHERE rowid = {projeto_ref};{_fts_insert_sql(f'p.id = {projeto_ref}')}"""
+
+
+FTS_TRIGGERS = {
+    "trg_fts_projeto_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fts_projeto_insert AFTER INSERT ON projetos
+        BEGIN {_fts_refresh_sql('NEW.id')}
+        END""",
+    "trg_fts_projeto_update": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fts_projeto_update
+        AFTER UPDATE OF cliente, categoria, desconto_texto ON projetos
+        BEGIN {_fts_refresh_sql('NEW.id')}
+        END""",
+    "trg_fts_projeto_delete": """
+        CREATE TRIGGER IF NOT EXISTS trg_fts_projeto_delete AFTER DELETE ON projetos
+        BEGIN DELETE FROM projetos_fts WHERE rowid = OLD.id;
+        END""",
+    "trg_fts_tarefa_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fts_tarefa_insert AFTER INSERT ON tarefas_projeto
+        BEGIN {_fts_refresh_sql('NEW.projeto_id')}
+        END""",
+    "trg_fts_tarefa_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fts_tarefa_delete AFTER DELETE ON tarefas_projeto
+        BEGIN {_fts_refresh_sql('OLD.projeto_id')}
+        END""",
+    "trg_fts_tarefa_update": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fts_tarefa_update
+        AFTER UPDATE OF projeto_id, descricao ON tarefas_projeto
+        BEGIN {_fts_refresh_sql('OLD.projeto_id')} {_fts_refresh_sql('NEW.projeto_id')}
+        END""",
+}
+
+
+# --- Histórico de status ---
+# Toda troca de status vira uma linha em status_historico, venha de set_status ou da edição do
+# projeto. O horário (época) é o data_atualizacao gravado junto (ou agora, se ele não mudou).
+STATUS_TRIGGERS = {
+    "trg_status_historico": """
+        CREATE TRIGGER IF NOT EXISTS trg_status_historico AFTER UPDATE OF status ON projetos
+        WHEN NEW.status IS NOT OLD.status
+        BEGIN
+            INSERT INTO status_historico (projeto_id, de, para, timestamp)
+            VALUES (NEW.id, OLD.status, NEW.status,
+                    CASE WHEN NEW.data_atualizacao IS NOT OLD.data_atualizacao THEN NEW.data_atualizacao
+                         ELSE CAST(strftime('%s', 'now') AS INTEGER) END);
+        END""",
+}
+
+
+@dataclass(frozen=True)
+class DashboardSnapshot:
+    # Fotografia imutável da aba Home, calculada de uma vez por get_dashboard_snapshot
+    periodo: str
+    total_projetos: int
+    total_orcado: float
+    ticket_medio: float
+    total_convertidos: int
+    status_dist: tuple            # ((status, qtd), ...)
+    receita_por_categoria: tuple  # ((categoria, receita), ...)
+    horas_totais: float
+    valor_hora_real: float
+    custo_hora_tecnica: float
+    faturamento_mes: float
+    meta_mensal: float
+    nome_usuario: str
+
+    @property
+    def conversao_pct(self):
+        return (self.total_convertidos / self.total_projetos * 100) if self.total_projetos > 0 else 0
+
+    @property
+    def progresso_meta(self):
+        # Fração da meta mensal atingida, limitada a 1
+        pct = self.faturamento_mes / self.meta_mensal if self.meta_mensal > 0 else 0
+        return min(pct, 1)
+
 
 class Database:
+    # Aplicados em toda conexão nova. WAL deixa leitores rodando durante uma escrita;
+    # synchronous=NORMAL é seguro em WAL (só o último commit pode se perder numa queda de energia).
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA cache_size = -20000",      # ~20 MB
+        "PRAGMA mmap_size = 268435456",    # 256 MB
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA foreign_keys = ON",        # tarefas saem junto com o projeto (ON DELETE CASCADE)
+    )
+    BUSY_TIMEOUT = 5.0  # segundos esperando um lock antes de "database is locked"
+    CONFIG_RECHECK = 1.0  # segundos entre consultas a PRAGMA data_version com o cache de configuração válido
+
     def __init__(self, db_name="meus_projetos.db"):
-        self.conn = sqlite3.connect(db_name)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
-        self.check_and_migrate()
-        self.seed_data()
+        self.db_name = db_name
+        # Uma conexão (e um cursor legado) por thread: sqlite3 não compartilha conexões entre threads
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._connections = []
+        # Cache de get_service_usage_counts: ((conexão, total_changes, data_version) quando calculado, contagens)
+        self._usage_cache = None
+        # Cache de get_service_hour_dispersion, com a mesma chave de _usage_cache
+        self._dispersion_cache = None
+        # Cache de get_config/get_total_custos_operacionais: (conexão, data_version, lido_em, config, total)
+        self._config_cache = None
+        # Versão dos valores de precificação: (número, config, total); o número sobe quando eles mudam
+        self._config_version = (0, None, None)
+        self._fts_enabled = None
+        self.migrate()
+
+    def _connect(self):
+        # check_same_thread=False só para close() poder fechar conexões de outras threads
+        conn = sqlite3.connect(self.db_name, timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._pool_lock:
+                self._connections.append(conn)
+        return conn
+
+    @property
+    def cursor(self):
+        # Legado: a UI ainda executa SQL direto em db.cursor. Os métodos daqui usam o próprio cursor.
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None or getattr(self._local, "cursor_conn", None) is not self.conn:
+            cursor = self._local.cursor = self.conn.cursor()
+            self._local.cursor_conn = self.conn
+        return cursor
+
+    def release_connection(self):
+        # Fecha a conexão da thread atual (threads de trabalho chamam ao terminar)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        with self._pool_lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+        self._local.conn = self._local.cursor = None
+
+    def close(self):
+        with self._pool_lock:
+            conns, self._connections = self._connections, []
+        for conn in conns:
+            conn.close()
+        # Threads que voltarem a usar este objeto abrem conexões novas
+        self._local = threading.local()
+
+    @contextmanager
+    def transaction(self):
+        """Agrupa várias escritas numa transação atômica, com um único commit no fim.
+
+        O bloco mais externo abre com BEGIN IMMEDIATE; blocos internos viram SAVEPOINTs, e o commit()
+        dos métodos chamados dentro do bloco fica para o bloco mais externo. Uma exceção desfaz só o bloco onde ocorreu.
+        """
+        conn = self.conn
+        depth = getattr(self._local, "tx_depth", 0)
+        if depth == 0:
+            if not conn.in_transaction:
+                # IMMEDIATE: o lock de escrita vem já no início (esperando até BUSY_TIMEOUT). Com um BEGIN
+                # comum, um bloco que lê antes de escrever falha na hora com "database is locked" se outra
+                # conexão gravar no meio, pois em WAL essa promoção de leitura para escrita não espera
+                conn.execute("BEGIN IMMEDIATE")
+        else:
+            conn.execute(f"SAVEPOINT tx_{depth}")
+        self._local.tx_depth = depth + 1
+        try:
+            yield
+        except BaseException:
+            if depth == 0:
+                conn.rollback()
+            else:
+                conn.execute(f"ROLLBACK TO tx_{depth}")
+                conn.execute(f"RELEASE tx_{depth}")
+            raise
+        else:
+            if depth == 0:
+                conn.commit()
+            else:
+                conn.execute(f"RELEASE tx_{depth}")
+        finally:
+            self._local.tx_depth = depth
+
+    def commit(self):
+        # Dentro de transaction() o commit fica para o fim do bloco mais externo
+        if not getattr(self._local, "tx_depth", 0):
+            self.conn.commit()
+
+    def backup_to(self, filename):
+        # Cópia consistente pela API de backup do SQLite (copiar o arquivo perderia o que está no -wal)
+        dest = sqlite3.connect(filename)
+        try:
+            self.conn.backup(dest)
+        finally:
+            dest.close()
+
+    def restore_from(self, filename):
+        # Sobrescreve o banco atual com o conteúdo de 'filename', pela mesma API
+        src = sqlite3.connect(filename)
+        try:
+            src.backup(self.conn)
+        finally:
+            src.close()
+        self.invalidate_config_cache()
+
+    # Passos de schema em ordem; depois do passo i o banco fica na versão i + 1 (PRAGMA user_version).
+    # Bancos de antes do controle de versão estão na versão 0: os primeiros passos são idempotentes
+    # (IF NOT EXISTS, checagem de colunas) e servem tanto para bancos novos quanto para os antigos.
+    # Passos novos entram sempre no fim da lista.
+    MIGRATIONS = (
+        "create_tables",
+        "check_and_migrate",
+        "create_indexes",
+        "create_rollups",
+        "create_search_index",
+        "create_status_history",
+        "seed_data",
+        "migrate_compact_storage",
+    )
+
+    def migrate(self):
+        """Aplica os passos de MIGRATIONS que faltam, todos numa transação.
+
+        Com o banco em dia, abrir custa só a leitura do user_version.
+        """
+        conn = self.conn
+        versao = conn.execute("PRAGMA user_version").fetchone()[0]
+        if versao >= len(self.MIGRATIONS):
+            return
+
+        # foreign_keys só muda fora de transação; desligado, um passo pode recriar uma tabela
+        # referenciada (migrate_tarefas_foreign_keys). A conferência fica para o fim.
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            with self.transaction():
+                for nome in self.MIGRATIONS[versao:]:
+                    getattr(self, nome)()
+                if conn.execute("PRAGMA foreign_key_check").fetchone():
+                    raise sqlite3.IntegrityError("Chave estrangeira inválida após a migração")
+                conn.execute(f"PRAGMA user_version = {len(self.MIGRATIONS)}")
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+
+    @property
+    def fts_enabled(self):
+        # Definido por create_search_index na migração; ao abrir um banco em dia, é a existência do índice
+        if self._fts_enabled is None:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='projetos_fts'")
+            self._fts_enabled = cursor.fetchone() is not None
+        return self._fts_enabled
+
+    # Colunas das tabelas que as migrações recriam (_rebuild_table); create_tables usa as mesmas
+    TABLE_COLUMNS = {
+        "projetos": """
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cliente TEXT,
+            data_criacao TEXT,
+            data_entrega TEXT,
+            status TEXT,
+            custo_extras INTEGER,
+            preco_final INTEGER,
+            categoria TEXT DEFAULT 'Geral',
+            data_atualizacao INTEGER,
+            desconto_texto TEXT DEFAULT '',
+            horas_totais REAL DEFAULT 0
+        """,
+        "tarefas_projeto": """
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            projeto_id INTEGER,
+            descricao TEXT,
+            horas_estimadas REAL,
+            servico_id INTEGER REFERENCES catalogo_servicos(id) ON DELETE SET NULL,
+            FOREIGN KEY(projeto_id) REFERENCES projetos(id) ON DELETE CASCADE
+        """,
+        "status_historico": """
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            projeto_id INTEGER REFERENCES projetos(id) ON DELETE CASCADE,
+            de TEXT,
+            para TEXT,
+            timestamp INTEGER
+        """,
+    }
 
     def create_tables(self):
+        cursor = self.conn.cursor()
         # Tabela de Configurações Financeiras
-        self.cursor.execute("""
+        cursor.execute("""
             CREATE TABLE IF NOT EXISTS configuracoes (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 custo_mensal REAL,
@@ -25,7 +434,7 @@ class Database:
         """)
 
         # Tabela de Catálogo de Serviços
-        self.cursor.execute("""
+        cursor.execute("""
             CREATE TABLE IF NOT EXISTS catalogo_servicos (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 nome TEXT,
@@ -35,7 +444,7 @@ class Database:
         """)
 
         # Tabela de Custos Operacionais
-        self.cursor.execute("""
+        cursor.execute("""
             CREATE TABLE IF NOT EXISTS custos_operacionais (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 descricao TEXT,
@@ -44,49 +453,29 @@ class Database:
         """)
 
         # Tabela de Projetos
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS projetos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                cliente TEXT,
-                data_criacao TEXT,
-                data_entrega TEXT,
-                status TEXT,
-                custo_extras REAL,
-                preco_final REAL,
-                categoria TEXT DEFAULT 'Geral',
-                data_atualizacao TEXT,
-                desconto_texto TEXT DEFAULT ''
-            )
-        """)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS projetos ({self.TABLE_COLUMNS['projetos']})")
 
         # Tabela de Tarefas salvas em cada Projeto
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS tarefas_projeto (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                projeto_id INTEGER,
-                descricao TEXT,
-                horas_estimadas REAL,
-                FOREIGN KEY(projeto_id) REFERENCES projetos(id)
-            )
-        """)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS tarefas_projeto ({self.TABLE_COLUMNS['tarefas_projeto']})")
 
         # Tabela de Histórico de Alterações (Audit Trail)
-        self.cursor.execute("""
+        cursor.execute("""
             CREATE TABLE IF NOT EXISTS change_log (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 timestamp TEXT,
                 descricao TEXT
             )
         """)
-        self.conn.commit()
+        self.commit()
 
     def check_and_migrate(self):
+        cursor = self.conn.cursor()
         # Verifica colunas em 'catalogo_servicos'
-        self.cursor.execute("PRAGMA table_info(catalogo_servicos)")
-        cols = [info[1] for info in self.cursor.fetchall()]
+        cursor.execute("PRAGMA table_info(catalogo_servicos)")
+        cols = [info[1] for info in cursor.fetchall()]
         if "categoria" not in cols:
             print("Migrando DB: Adicionando coluna 'categoria' em catalogo_servicos...")
-            self.cursor.execute("ALTER TABLE catalogo_servicos ADD COLUMN categoria TEXT DEFAULT 'Geral'")
+            cursor.execute("ALTER TABLE catalogo_servicos ADD COLUMN categoria TEXT DEFAULT 'Geral'")
 
             # Atualiza categorias padrão para dados existentes (tentativa heurística)
             mapping = {
@@ -96,61 +485,324 @@ class Database:
             }
             for cat, keywords in mapping.items():
                 for kw in keywords:
-                    self.cursor.execute(f"UPDATE catalogo_servicos SET categoria = ? WHERE nome LIKE ?", (cat, f"%{kw}%"))
-            self.conn.commit()
+                    cursor.execute(f"UPDATE catalogo_servicos SET categoria = ? WHERE nome LIKE ?", (cat, f"%{kw}%"))
+            self.commit()
 
         if "tags" not in cols:
             print("Migrando DB: Adicionando coluna 'tags' em catalogo_servicos...")
-            self.cursor.execute("ALTER TABLE catalogo_servicos ADD COLUMN tags TEXT DEFAULT ''")
-            self.conn.commit()
+            cursor.execute("ALTER TABLE catalogo_servicos ADD COLUMN tags TEXT DEFAULT ''")
+            self.commit()
 
         # Verifica colunas em 'configuracoes'
-        self.cursor.execute("PRAGMA table_info(configuracoes)")
-        cols = [info[1] for info in self.cursor.fetchall()]
+        cursor.execute("PRAGMA table_info(configuracoes)")
+        cols = [info[1] for info in cursor.fetchall()]
         if "meta_mensal" not in cols:
             print("Migrando DB: Adicionando coluna 'meta_mensal' em configuracoes...")
-            self.cursor.execute("ALTER TABLE configuracoes ADD COLUMN meta_mensal REAL DEFAULT 10000.0")
+            cursor.execute("ALTER TABLE configuracoes ADD COLUMN meta_mensal REAL DEFAULT 10000.0")
         if "nome_usuario" not in cols:
             print("Migrando DB: Adicionando coluna 'nome_usuario' em configuracoes...")
-            self.cursor.execute("ALTER TABLE configuracoes ADD COLUMN nome_usuario TEXT DEFAULT 'Visitante'")
+            cursor.execute("ALTER TABLE configuracoes ADD COLUMN nome_usuario TEXT DEFAULT 'Visitante'")
 
         # Verifica colunas em 'projetos'
-        self.cursor.execute("PRAGMA table_info(projetos)")
-        cols = [info[1] for info in self.cursor.fetchall()]
+        cursor.execute("PRAGMA table_info(projetos)")
+        cols = [info[1] for info in cursor.fetchall()]
 
         if "data_entrega" not in cols:
             print("Migrando DB: Adicionando coluna 'data_entrega' em projetos...")
-            self.cursor.execute("ALTER TABLE projetos ADD COLUMN data_entrega TEXT")
+            cursor.execute("ALTER TABLE projetos ADD COLUMN data_entrega TEXT")
 
         if "categoria" not in cols:
             print("Migrando DB: Adicionando coluna 'categoria' em projetos...")
-            self.cursor.execute("ALTER TABLE projetos ADD COLUMN categoria TEXT DEFAULT 'Geral'")
+            cursor.execute("ALTER TABLE projetos ADD COLUMN categoria TEXT DEFAULT 'Geral'")
 
         if "data_atualizacao" not in cols:
             print("Migrando DB: Adicionando coluna 'data_atualizacao' em projetos...")
-            self.cursor.execute("ALTER TABLE projetos ADD COLUMN data_atualizacao TEXT")
+            cursor.execute("ALTER TABLE projetos ADD COLUMN data_atualizacao TEXT")
             # Populate with data_criacao for existing records
-            self.cursor.execute("UPDATE projetos SET data_atualizacao = data_criacao WHERE data_atualizacao IS NULL")
+            cursor.execute("UPDATE projetos SET data_atualizacao = data_criacao WHERE data_atualizacao IS NULL")
 
         if "desconto_texto" not in cols:
             print("Migrando DB: Adicionando coluna 'desconto_texto' em projetos...")
-            self.cursor.execute("ALTER TABLE projetos ADD COLUMN desconto_texto TEXT DEFAULT ''")
+            cursor.execute("ALTER TABLE projetos ADD COLUMN desconto_texto TEXT DEFAULT ''")
+
+        # Verifica colunas em 'tarefas_projeto'
+        cursor.execute("PRAGMA table_info(tarefas_projeto)")
+        cols_tarefas = [info[1] for info in cursor.fetchall()]
+
+        if "servico_id" not in cols_tarefas:
+            print("Migrando DB: Vinculando tarefas_projeto ao catálogo (servico_id)...")
+            cursor.execute("ALTER TABLE tarefas_projeto ADD COLUMN servico_id INTEGER REFERENCES catalogo_servicos(id)")
+            # Vincula pelo nome; havendo nomes repetidos no catálogo, fica o serviço mais antigo
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_catalogo_nome ON catalogo_servicos(nome)")
+            cursor.execute("""
+                UPDATE tarefas_projeto SET servico_id = (
+                    SELECT MIN(c.id) FROM catalogo_servicos c WHERE c.nome = tarefas_projeto.descricao
+                )
+            """)
+
+        # Chaves estrangeiras antigas não tinham ON DELETE: a tabela é recriada (o SQLite não altera FKs)
+        cursor.execute("PRAGMA foreign_key_list(tarefas_projeto)")
+        acoes = {fk[3]: fk[6] for fk in cursor.fetchall()}  # coluna -> on_delete
+        if acoes.get("projeto_id") != "CASCADE":
+            print("Migrando DB: Tarefas passam a ser excluídas junto com o projeto (ON DELETE CASCADE)...")
+            self.migrate_tarefas_foreign_keys()
+
+        if "horas_totais" not in cols:
+            print("Migrando DB: Adicionando coluna 'horas_totais' em projetos...")
+            cursor.execute("ALTER TABLE projetos ADD COLUMN horas_totais REAL DEFAULT 0")
+            cursor.execute("""
+                UPDATE projetos SET horas_totais = (
+                    SELECT TOTAL(horas_estimadas) FROM tarefas_projeto WHERE projeto_id = projetos.id
+                )
+            """)
+
+        self.commit()
+
+    def _rebuild_table(self, tabela, select_sql):
+        # Roteiro de "mudanças de schema" da documentação do SQLite: cria a tabela nova com
+        # TABLE_COLUMNS, copia select_sql (colunas na mesma ordem) e troca os nomes. Roda dentro
+        # de migrate(), com foreign_keys desligado e conferido no fim. Índices e triggers da
+        # tabela somem com o DROP: quem chama os recria.
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (tabela,))
+        seq = cursor.fetchone()
+        cursor.execute(f"CREATE TABLE {tabela}_nova ({self.TABLE_COLUMNS[tabela]})")
+        cursor.execute(f"INSERT INTO {tabela}_nova {select_sql}")
+        cursor.execute(f"DROP TABLE {tabela}")
+        cursor.execute(f"ALTER TABLE {tabela}_nova RENAME TO {tabela}")
+        if seq:
+            cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name=?", (seq[0], tabela))
+
+    def migrate_tarefas_foreign_keys(self):
+        # Chaves com ON DELETE (o SQLite não altera FKs). Índices e triggers de tarefas_projeto
+        # voltam em create_indexes, create_rollups e create_search_index.
+        cursor = self.conn.cursor()
+        with self.transaction():
+            # Triggers de 'projetos' também citam tarefas_projeto; sem a tabela o RENAME falharia
+            for name in (*HORAS_TRIGGERS, *FTS_TRIGGERS):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            # Tarefas de projetos já excluídos ficam para trás; serviços apagados viram NULL
+            self._rebuild_table("tarefas_projeto", """
+                SELECT t.id, t.projeto_id, t.descricao, t.horas_estimadas,
+                       (SELECT c.id FROM catalogo_servicos c WHERE c.id = t.servico_id)
+                FROM tarefas_projeto t
+                WHERE t.projeto_id IN (SELECT id FROM projetos)
+            """)
+
+    def migrate_compact_storage(self):
+        # Dinheiro REAL -> centavos, data_atualizacao em texto -> época, data_entrega dd/mm/aaaa -> ISO.
+        # O SQLite não muda o tipo de uma coluna: 'projetos' e 'status_historico' são recriadas e os
+        # derivados (resumo em centavos, índices, triggers) refeitos em cima delas.
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA table_info(projetos)")
+        if {info[1]: info[2] for info in cursor.fetchall()}.get("preco_final") == "INTEGER":
+            return  # Banco criado já no formato novo
+
+        print("Migrando DB: Valores em centavos e datas em formato compacto...")
+        # Textos em hora local -> segundos desde a época
+        epoca = "CASE WHEN typeof({0}) = 'text' THEN CAST(strftime('%s', {0}, 'utc') AS INTEGER) ELSE {0} END"
+        with self.transaction():
+            for name in (*ROLLUP_TRIGGERS, *HORAS_TRIGGERS, *FTS_TRIGGERS, *STATUS_TRIGGERS):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            self._rebuild_table("projetos", f"""
+                SELECT id, cliente, data_criacao,
+                       CASE WHEN data_entrega LIKE '__/__/____'
+                            THEN substr(data_entrega, 7, 4) || '-' || substr(data_entrega, 4, 2) || '-' || substr(data_entrega, 1, 2)
+                            WHEN data_entrega LIKE '____-__-__' THEN data_entrega END,
+                       status, CAST(ROUND(custo_extras * 100) AS INTEGER), CAST(ROUND(preco_final * 100) AS INTEGER),
+                       categoria, {epoca.format('data_atualizacao')}, desconto_texto, horas_totais
+                FROM projetos
+            """)
+            self._rebuild_table("status_historico", f"""
+                SELECT id, projeto_id, de, para, {epoca.format('timestamp')} FROM status_historico
+            """)
+            cursor.execute("DROP TABLE IF EXISTS resumo_mensal")
+            self.create_indexes()
+            self.create_rollups()
+            self.create_search_index()
+            self.create_status_history()
+
+    def create_indexes(self):
+        # Criados após a migração: bancos antigos podem não ter status/data_atualizacao antes dela
+        cursor = self.conn.cursor()
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_projetos_data_criacao ON projetos(data_criacao)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_projetos_status_atualizacao ON projetos(status, data_atualizacao)")
+        # Ordenações da lista de projetos (o rowid entra no índice e desempata)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_projetos_atualizacao ON projetos(data_atualizacao)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_projetos_preco ON projetos(preco_final)")
+        # Filtros da linguagem de busca (search_query.py)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_projetos_categoria ON projetos(categoria)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_projetos_entrega ON projetos(data_entrega)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_projeto_id ON tarefas_projeto(projeto_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_servico ON tarefas_projeto(servico_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_catalogo_nome ON catalogo_servicos(nome)")
+        self.commit()
+
+    def create_rollups(self):
+        # Tabela 'resumo_mensal': contagem, receita e horas por (ano, mês, categoria, status),
+        # mantida por triggers para que a Home não precise varrer 'projetos'.
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='resumo_mensal'")
+        is_new = cursor.fetchone() is None
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS resumo_mensal (
+                ano INTEGER,
+                mes INTEGER,
+                categoria TEXT,
+                status TEXT,
+                qtd_projetos INTEGER DEFAULT 0,
+                receita INTEGER DEFAULT 0,
+                horas REAL DEFAULT 0,
+                PRIMARY KEY (ano, mes, categoria, status)
+            )
+        """)
+        for sql in ROLLUP_TRIGGERS.values():
+            cursor.execute(sql)
+        # projetos.horas_totais acompanha as tarefas (e alimenta o resumo)
+        for sql in HORAS_TRIGGERS.values():
+            cursor.execute(sql)
+        self.commit()
+
+        if is_new:
+            print("Migrando DB: Calculando resumo mensal...")
+            self.rebuild_rollups()
+
+    def create_search_index(self):
+        # Índice FTS5 de cliente, categoria, desconto e tarefas para search_projects.
+        # Se o SQLite não tiver FTS5, a busca continua no caminho antigo (LIKE).
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='projetos_fts'")
+        is_new = cursor.fetchone() is None
+
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS projetos_fts
+                USING fts5(cliente, categoria, desconto_texto, tarefas, tokenize='unicode61 remove_diacritics 2')
+            """)
+        except sqlite3.OperationalError:
+            print("Aviso: SQLite sem FTS5, busca de projetos usará LIKE.")
+            self._fts_enabled = False
+            return
+
+        self._fts_enabled = True
+        for sql in FTS_TRIGGERS.values():
+            cursor.execute(sql)
+
+        if is_new:
+            print("Migrando DB: Indexando projetos para busca...")
+            cursor.execute(_fts_insert_sql("1"))
+        self.commit()
+
+    def create_status_history(self):
+        # Histórico de status dos projetos (funil de get_status_funnel), preenchido por trigger.
+        # Depois da migração: o trigger lê projetos.data_atualizacao.
+        cursor = self.conn.cursor()
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS status_historico ({self.TABLE_COLUMNS['status_historico']})")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_status_historico ON status_historico(projeto_id, timestamp)")
+        for sql in STATUS_TRIGGERS.values():
+            cursor.execute(sql)
+        self.commit()
+
+    def rebuild_rollups(self):
+        # Manutenção: recalcula 'resumo_mensal' do zero a partir de projetos/tarefas
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM resumo_mensal")
+        cursor.execute(_rollup_merge_sql("1"))
+        self.commit()
+
+    def _rollup_filter(self, filtro_mes=None, filtro_ano=None, filtro_dia=None):
+        # Filtro equivalente sobre 'resumo_mensal', ou None quando há filtro por dia
+        # (o resumo é mensal; nesse caso a consulta cai para 'projetos').
+        if filtro_dia:
+            return None
+        where_clauses = []
+        params = []
+        if filtro_ano and filtro_ano != "Todos":
+            where_clauses.append("ano = ?")
+            params.append(int(filtro_ano))
+        if filtro_mes and filtro_mes != "Todos":
+            where_clauses.append("mes = ?")
+            params.append(int(filtro_mes))
+        return where_clauses, params
+
+    def _metrics_source(self, filtro_mes=None, filtro_ano=None, filtro_dia=None):
+        # Origem das métricas agregadas: 'resumo_mensal' sempre que o filtro couber nele,
+        # senão a própria tabela 'projetos'. Retorna (colunas, where_clauses, params).
+        rollup = self._rollup_filter(filtro_mes, filtro_ano, filtro_dia)
+        if rollup is not None:
+            cols = {"tabela": "resumo_mensal", "qtd": "SUM(qtd_projetos)", "receita": "SUM(receita) / 100.0",
+                    "status": "NULLIF(status, '')", "categoria": "NULLIF(categoria, '')"}
+            return cols, rollup[0], rollup[1]
+
+        where_clauses, params = self._compile_date_filter(filtro_mes, filtro_ano, filtro_dia)
+        cols = {"tabela": "projetos", "qtd": "COUNT(*)", "receita": "SUM(preco_final) / 100.0",
+                "status": "status", "categoria": "categoria"}
+        return cols, where_clauses, params
+
+    def _date_bounds(self, filtro_mes=None, filtro_ano=None, filtro_dia=None):
+        # Intervalo semiaberto [inicio, fim) em YYYY-MM-DD para o filtro, ou None se não houver ano.
+        # data_criacao é gravada como YYYY-MM-DD, então a comparação de strings é cronológica.
+        mes = filtro_mes if filtro_mes and filtro_mes != "Todos" else None
+        ano = filtro_ano if filtro_ano and filtro_ano != "Todos" else None
+        if not ano:
+            return None
+
+        ano_i = int(ano)
+        if mes and filtro_dia:
+            inicio = datetime.date(ano_i, int(mes), int(filtro_dia))
+            fim = inicio + datetime.timedelta(days=1)
+        elif mes:
+            inicio = datetime.date(ano_i, int(mes), 1)
+            fim = datetime.date(ano_i + 1, 1, 1) if int(mes) == 12 else datetime.date(ano_i, int(mes) + 1, 1)
+        else:
+            inicio = datetime.date(ano_i, 1, 1)
+            fim = datetime.date(ano_i + 1, 1, 1)
+        return inicio.isoformat(), fim.isoformat()
+
+    def _compile_date_filter(self, filtro_mes=None, filtro_ano=None, filtro_dia=None, column="data_criacao"):
+        # Converte os filtros de mês/ano/dia em "column >= ? AND column < ?", para que o índice
+        # de data_criacao possa ser usado (strftime() na coluna impede o uso do índice).
+        # Retorna (where_clauses, params).
+        mes = filtro_mes if filtro_mes and filtro_mes != "Todos" else None
+        dia = filtro_dia if filtro_dia else None
+
+        where_clauses = []
+        params = []
+
+        bounds = self._date_bounds(filtro_mes, filtro_ano, filtro_dia)
+        if bounds:
+            where_clauses.append(f"{column} >= ? AND {column} < ?")
+            params.extend(bounds)
+            if mes:
+                # Mês (e dia, se houver) já estão cobertos pelo intervalo
+                mes, dia = None, None
+
+        # Combinações sem ano (ex: "todo mês 03") não formam um intervalo contínuo
+        if mes:
+            where_clauses.append(f"strftime('%m', {column}) = ?")
+            params.append(mes)
+
+        if dia:
+            where_clauses.append(f"strftime('%d', {column}) = ?")
+            params.append(dia)
 
-        self.conn.commit()
+        return where_clauses, params
 
     def seed_data(self):
+        cursor = self.conn.cursor()
         # Seed Configurações
-        self.cursor.execute("SELECT count(*) FROM configuracoes")
-        if self.cursor.fetchone()[0] == 0:
-            self.cursor.execute("""
+        cursor.execute("SELECT count(*) FROM configuracoes")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("""
                 INSERT INTO configuracoes (custo_mensal, horas_mensais, imposto_padrao, lucro_padrao, meta_mensal, nome_usuario)
                 VALUES (?, ?, ?, ?, ?, ?)
             """, (5495.0, 180.0, 32.0, 30.0, 15000.0, "Okami"))
-            self.conn.commit()
+            self.commit()
 
         # Seed Catálogo de Serviços
-        self.cursor.execute("SELECT count(*) FROM catalogo_servicos")
-        if self.cursor.fetchone()[0] == 0:
+        cursor.execute("SELECT count(*) FROM catalogo_servicos")
+        if cursor.fetchone()[0] == 0:
             tarefas_iniciais = [
                 ("Fechamento Orçamentário", 4, "Pré-Projeto"),
                 ("Pesquisa de referencias", 4, "Pré-Projeto"),
@@ -166,13 +818,13 @@ class Database:
                 ("Detalhamentos finais", 2, "Pós-Produção"),
                 ("Entrega", 3, "Pós-Produção")
             ]
-            self.cursor.executemany("INSERT INTO catalogo_servicos (nome, horas_padrao, categoria) VALUES (?, ?, ?)", tarefas_iniciais)
-            self.conn.commit()
+            cursor.executemany("INSERT INTO catalogo_servicos (nome, horas_padrao, categoria) VALUES (?, ?, ?)", tarefas_iniciais)
+            self.commit()
             print("Catálogo de serviços inicial criado.")
 
         # Seed Custos Operacionais
-        self.cursor.execute("SELECT count(*) FROM custos_operacionais")
-        if self.cursor.fetchone()[0] == 0:
+        cursor.execute("SELECT count(*) FROM custos_operacionais")
+        if cursor.fetchone()[0] == 0:
             custos_iniciais = [
                 ("Água", 35.0), ("Luz", 500.0), ("Telefone", 300.0), ("Internet", 50.0),
                 ("IPTU", 200.0), ("Condomínio", 100.0), ("Aluguel", 100.0), ("Faxina", 100.0),
@@ -182,154 +834,333 @@ class Database:
                 ("Marketing", 100.0), ("Conselho Profissional", 100.0), ("Cursos", 100.0),
                 ("Terceirizados", 10.0)
             ]
-            self.cursor.executemany("INSERT INTO custos_operacionais (descricao, valor) VALUES (?, ?)", custos_iniciais)
-            self.conn.commit()
+            cursor.executemany("INSERT INTO custos_operacionais (descricao, valor) VALUES (?, ?)", custos_iniciais)
+            self.commit()
             print("Custos operacionais iniciais criados.")
 
     # Métodos de Configuração
+    def _pricing_inputs(self):
+        # (config, total de custos operacionais, versão), lidos juntos e mantidos em memória: o orçamento é
+        # recalculado a cada clique e não precisa ir ao banco. As escritas desta classe limpam o cache
+        # (invalidate_config_cache); commits de outras conexões aparecem em PRAGMA data_version, consultado
+        # no máximo a cada CONFIG_RECHECK segundos. Dentro de uma transação não há cache (pode haver rollback).
+        conn = self.conn
+        cache = self._config_cache
+        agora = time.monotonic()
+        if cache is not None and cache[0] is conn:
+            if agora - cache[2] < self.CONFIG_RECHECK:
+                return cache[3:]
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == cache[1]:
+                self._config_cache = (conn, version, agora) + cache[3:]
+                return cache[3:]
+
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA data_version")
+        version = cursor.fetchone()[0]
+        cursor.execute("SELECT * FROM configuracoes ORDER BY id DESC LIMIT 1")
+        config = cursor.fetchone()
+        cursor.execute("SELECT SUM(valor) FROM custos_operacionais")
+        total = cursor.fetchone()[0] or 0.0
+        # A versão só avança se os valores mudaram: releituras por escritas em outras tabelas não contam
+        numero, config_antiga, total_antigo = self._config_version
+        if (config, total) != (config_antiga, total_antigo):
+            numero += 1
+            self._config_version = (numero, config, total)
+        if not conn.in_transaction:
+            self._config_cache = (conn, version, agora, config, total, numero)
+        return config, total, numero
+
+    def get_pricing_inputs(self):
+        # (config, total de custos operacionais, versão) de uma só leitura, para PricingContext
+        return self._pricing_inputs()
+
+    def config_version(self):
+        # Muda sempre que a configuração ou os custos operacionais mudam; sem SQL com o cache válido
+        return self._pricing_inputs()[2]
+
+    def invalidate_config_cache(self):
+        self._config_cache = None
+
     def get_config(self):
-        self.cursor.execute("SELECT * FROM configuracoes ORDER BY id DESC LIMIT 1")
-        return self.cursor.fetchone()
+        return self._pricing_inputs()[0]
 
     def update_config(self, custo, horas, imposto, lucro, meta, nome):
+        cursor = self.conn.cursor()
         # Get old config for diff logging
         old_cfg = self.get_config() # (id, custo, horas, imposto, lucro, meta, nome)
 
-        # Verifica se já existe config
-        if old_cfg:
-            self.cursor.execute("""
-                UPDATE configuracoes SET custo_mensal=?, horas_mensais=?, imposto_padrao=?, lucro_padrao=?, meta_mensal=?, nome_usuario=?
-                WHERE id = (SELECT MAX(id) FROM configuracoes)
-            """, (custo, horas, imposto, lucro, meta, nome))
-
-            # Log changes
-            changes = []
-            if abs(old_cfg[1] - custo) > 0.01: changes.append(f"Custo Mensal: {old_cfg[1]} -> {custo}")
-            if abs(old_cfg[3] - imposto) > 0.01: changes.append(f"Imposto: {old_cfg[3]}% -> {imposto}%")
-            if abs(old_cfg[4] - lucro) > 0.01: changes.append(f"Lucro: {old_cfg[4]}% -> {lucro}%")
+        with self.transaction():
+            # Verifica se já existe config
+            if old_cfg:
+                cursor.execute("""
+                    UPDATE configuracoes SET custo_mensal=?, horas_mensais=?, imposto_padrao=?, lucro_padrao=?, meta_mensal=?, nome_usuario=?
+                    WHERE id = (SELECT MAX(id) FROM configuracoes)
+                """, (custo, horas, imposto, lucro, meta, nome))
 
-            if changes:
-                log_msg = " | ".join(changes)
-                self.log_change(log_msg)
+                # Log changes
+                changes = []
+                if abs(old_cfg[1] - custo) > 0.01: changes.append(f"Custo Mensal: {old_cfg[1]} -> {custo}")
+                if abs(old_cfg[3] - imposto) > 0.01: changes.append(f"Imposto: {old_cfg[3]}% -> {imposto}%")
+                if abs(old_cfg[4] - lucro) > 0.01: changes.append(f"Lucro: {old_cfg[4]}% -> {lucro}%")
 
-        else:
-             self.cursor.execute("""
-                INSERT INTO configuracoes (custo_mensal, horas_mensais, imposto_padrao, lucro_padrao, meta_mensal, nome_usuario)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (custo, horas, imposto, lucro, meta, nome))
-             self.log_change("Configuração inicial criada.")
+                if changes:
+                    log_msg = " | ".join(changes)
+                    self.log_change(log_msg)
 
-        self.conn.commit()
+            else:
+                cursor.execute("""
+                    INSERT INTO configuracoes (custo_mensal, horas_mensais, imposto_padrao, lucro_padrao, meta_mensal, nome_usuario)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (custo, horas, imposto, lucro, meta, nome))
+                self.log_change("Configuração inicial criada.")
+        self.invalidate_config_cache()
+
+    def factory_reset(self):
+        # Volta configuração e custos operacionais ao padrão de seed_data; projetos e catálogo ficam
+        with self.transaction():
+            self.conn.execute("DELETE FROM configuracoes")
+            self.conn.execute("DELETE FROM custos_operacionais")
+            self.seed_data()
+            self.log_change("FACTORY RESET realizado.")
+        self.invalidate_config_cache()
 
     def log_change(self, descricao):
+        cursor = self.conn.cursor()
         ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.cursor.execute("INSERT INTO change_log (timestamp, descricao) VALUES (?, ?)", (ts, descricao))
-        self.conn.commit()
+        cursor.execute("INSERT INTO change_log (timestamp, descricao) VALUES (?, ?)", (ts, descricao))
+        self.commit()
 
     def get_change_log(self):
-        self.cursor.execute("SELECT timestamp, descricao FROM change_log ORDER BY id DESC LIMIT 50")
-        return self.cursor.fetchall()
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT timestamp, descricao FROM change_log ORDER BY id DESC LIMIT 50")
+        return cursor.fetchall()
 
     # Métodos do Catálogo
     def get_servicos(self):
-        self.cursor.execute("SELECT id, nome, horas_padrao, categoria, tags FROM catalogo_servicos ORDER BY categoria, nome")
-        return self.cursor.fetchall()
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id, nome, horas_padrao, categoria, tags FROM catalogo_servicos ORDER BY categoria, nome")
+        return cursor.fetchall()
 
     def get_categorias(self):
-        self.cursor.execute("SELECT DISTINCT categoria FROM catalogo_servicos ORDER BY categoria")
-        return [row[0] for row in self.cursor.fetchall()]
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT DISTINCT categoria FROM catalogo_servicos ORDER BY categoria")
+        return [row[0] for row in cursor.fetchall()]
 
     def add_servico(self, nome, horas, categoria="Geral", tags=""):
-        self.cursor.execute("INSERT INTO catalogo_servicos (nome, horas_padrao, categoria, tags) VALUES (?, ?, ?, ?)", (nome, horas, categoria, tags))
-        self.conn.commit()
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO catalogo_servicos (nome, horas_padrao, categoria, tags) VALUES (?, ?, ?, ?)", (nome, horas, categoria, tags))
+        self.commit()
+
+    def bulk_import_servicos(self, rows, upsert=True, chunk_size=1000, progress=None):
+        """Importa (nome, horas[, categoria[, tags]]) em lotes, numa única transação.
+
+        Com upsert=True um nome já existente no catálogo é atualizado em vez de duplicado
+        (se houver repetidos, vale o de menor id). Linhas sem nome ou com horas inválidas são
+        ignoradas. progress(linhas_lidas) é chamado a cada lote. Retorna (inseridos, atualizados, ignorados).
+        """
+        cursor = self.conn.cursor()
+        inseridos = atualizados = ignorados = lidas = 0
+
+        with self.transaction():
+            cursor.execute("SELECT DISTINCT nome FROM catalogo_servicos")
+            existentes = {row[0] for row in cursor.fetchall()}
+
+            def gravar(lote):
+                # Dentro do lote vale a última linha de cada nome (com upsert)
+                if upsert:
+                    lote = list({r[0]: r for r in lote}.values())
+                    novos = [r for r in lote if r[0] not in existentes]
+                    updates = [(h, c, t, n) for n, h, c, t in lote if n in existentes]
+                else:
+                    novos, updates = lote, []
+                cursor.executemany("INSERT INTO catalogo_servicos (nome, horas_padrao, categoria, tags) VALUES (?, ?, ?, ?)", novos)
+                cursor.executemany("""
+                    UPDATE catalogo_servicos SET horas_padrao=?, categoria=?, tags=?
+                    WHERE id = (SELECT MIN(id) FROM catalogo_servicos WHERE nome=?)
+                """, updates)
+                existentes.update(r[0] for r in novos)
+                return len(novos), len(updates)
+
+            lote = []
+            for row in rows:
+                lidas += 1
+                nome = str(row[0] or "").strip() if len(row) > 0 else ""
+                try:
+                    horas = float(str(row[1]).replace(",", "."))
+                except (IndexError, TypeError, ValueError):
+                    horas = None
+                if not nome or horas is None or not 0 <= horas < float("inf"):
+                    ignorados += 1
+                    continue
+                categoria = (row[2] if len(row) > 2 else None) or "Geral"
+                tags = (row[3] if len(row) > 3 else None) or ""
+                lote.append((nome, horas, categoria.strip(), tags.strip()))
+
+                if len(lote) >= chunk_size:
+                    n_ins, n_upd = gravar(lote)
+                    inseridos, atualizados, lote = inseridos + n_ins, atualizados + n_upd, []
+                    if progress: progress(lidas)
+
+            if lote:
+                n_ins, n_upd = gravar(lote)
+                inseridos, atualizados = inseridos + n_ins, atualizados + n_upd
+            if progress: progress(lidas)
+
+        return inseridos, atualizados, ignorados
 
     def update_servico(self, id_servico, nome, horas, categoria, tags):
-        self.cursor.execute("UPDATE catalogo_servicos SET nome=?, horas_padrao=?, categoria=?, tags=? WHERE id=?",
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE catalogo_servicos SET nome=?, horas_padrao=?, categoria=?, tags=? WHERE id=?",
                             (nome, horas, categoria, tags, id_servico))
-        self.conn.commit()
+        self.commit()
 
     def delete_servico(self, id_servico):
-        self.cursor.execute("DELETE FROM catalogo_servicos WHERE id=?", (id_servico,))
-        self.conn.commit()
-
-    def get_service_usage_count(self, nome_servico):
-        # Checks how many tasks have this description/name
-        self.cursor.execute("SELECT COUNT(*) FROM tarefas_projeto WHERE descricao=?", (nome_servico,))
-        res = self.cursor.fetchone()
-        return res[0] if res else 0
-
-    def get_service_usage_stats(self, nome_servico):
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM catalogo_servicos WHERE id=?", (id_servico,))
+        self.commit()
+
+    def get_service_usage_count(self, id_servico):
+        # Checks how many project tasks are linked to this catalog service
+        return self.get_service_usage_counts().get(id_servico, 0)
+
+    def get_service_usage_counts(self):
+        # {servico_id: qtd de tarefas} para o catálogo inteiro, em um GROUP BY sobre idx_tarefas_servico.
+        # Fica em cache até a próxima escrita: total_changes muda a cada INSERT/UPDATE/DELETE desta conexão
+        # e data_version a cada commit de outra conexão (outra thread), o que cobre tarefas_projeto.
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA data_version")
+        changes = (self.conn, self.conn.total_changes, cursor.fetchone()[0])
+        if self._usage_cache is not None and self._usage_cache[0] == changes:
+            return self._usage_cache[1]
+
+        cursor.execute("SELECT servico_id, COUNT(*) FROM tarefas_projeto WHERE servico_id IS NOT NULL GROUP BY servico_id")
+        counts = dict(cursor.fetchall())
+        self._usage_cache = (changes, counts)
+        return counts
+
+    def get_service_hour_dispersion(self):
+        # {servico_id: (n, média, variância)} da razão horas da tarefa / horas_padrao do catálogo, sobre
+        # todas as tarefas já orçadas do serviço: quanto as horas reais de cada serviço fogem do padrão.
+        # Um GROUP BY só com somas (sem LN, que depende da compilação do SQLite); cache como o de usos.
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA data_version")
+        changes = (self.conn, self.conn.total_changes, cursor.fetchone()[0])
+        if self._dispersion_cache is not None and self._dispersion_cache[0] == changes:
+            return self._dispersion_cache[1]
+
+        cursor.execute("""
+            SELECT servico_id, COUNT(*), SUM(razao), SUM(razao * razao)
+            FROM (
+                SELECT t.servico_id, t.horas_estimadas / c.horas_padrao AS razao
+                FROM tarefas_projeto t
+                JOIN catalogo_servicos c ON c.id = t.servico_id
+                WHERE c.horas_padrao > 0 AND t.horas_estimadas > 0
+            )
+            GROUP BY servico_id
+        """)
+        dispersao = {}
+        for sid, n, soma, soma_q in cursor.fetchall():
+            media = soma / n
+            variancia = max((soma_q - soma * soma / n) / (n - 1), 0.0) if n > 1 else 0.0
+            dispersao[sid] = (n, media, variancia)
+        self._dispersion_cache = (changes, dispersao)
+        return dispersao
+
+    def get_service_usage_stats(self, id_servico):
         # Get usage count for last months? For now, total usage.
         # Also returns last usage date?
-        return self.get_service_usage_count(nome_servico)
+        return self.get_service_usage_count(id_servico)
+
+    def get_project_service_ids(self, projeto_id):
+        # Serviços do catálogo usados no projeto (tarefas antigas sem vínculo casam pelo nome)
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(t.servico_id, c.id)
+            FROM tarefas_projeto t
+            LEFT JOIN catalogo_servicos c ON t.servico_id IS NULL AND c.nome = t.descricao
+            WHERE t.projeto_id = ?
+        """, (projeto_id,))
+        return {row[0] for row in cursor.fetchall() if row[0] is not None}
 
     def adjust_catalog_hours(self, percentage):
         # Percentage e.g. 10.0 for +10%
+        cursor = self.conn.cursor()
         factor = 1 + (percentage / 100.0)
-        self.cursor.execute("UPDATE catalogo_servicos SET horas_padrao = horas_padrao * ?", (factor,))
-        self.conn.commit()
+        cursor.execute("UPDATE catalogo_servicos SET horas_padrao = horas_padrao * ?", (factor,))
+        self.commit()
 
     def get_most_profitable_service(self):
         # Approximated by Total Revenue generated by this service name across all projects.
         # Revenue = Task_Hours * (Project_Final_Price / Project_Total_Hours)
-        # This requires iteration or complex SQL.
-        # Alternative: Just Sum(Hours) if rate is stable.
-        # Let's do a SQL query that joins tasks and projects.
+        ranking = self.get_service_profitability_ranking(limit=1)
+        if ranking:
+            return ranking[0][0], ranking[0][1] # Name, Total Revenue
+        return None, 0.0
 
+    def get_service_profitability_ranking(self, period=None, limit=None):
+        # Receita, horas e valor/hora implícito de cada serviço, em uma varredura linear das tarefas.
+        # A receita da tarefa é a fatia do preço do projeto proporcional às suas horas
+        # (projetos.horas_totais é mantido por trigger, sem subconsulta correlacionada).
+        # period: filtro da Home ("Todos", "Este Mês", "Este Ano", "Hoje") sobre a data do projeto.
+        # Retorna [(nome, receita, horas, valor_hora), ...] do mais rentável ao menos.
+        # Tarefas vinculadas agrupam pelo servico_id (sobrevive a renomeações); as demais, pelo texto.
+        cursor = self.conn.cursor()
         query = """
-            SELECT t.descricao, SUM(t.horas_estimadas * (p.preco_final / NULLIF((SELECT SUM(tp.horas_estimadas) FROM tarefas_projeto tp WHERE tp.projeto_id = p.id), 0))) as receita_total
+            SELECT COALESCE(c.nome, t.descricao),
+                   SUM(t.horas_estimadas * (p.preco_final / 100.0 / NULLIF(p.horas_totais, 0))) AS receita_total,
+                   SUM(t.horas_estimadas)
             FROM tarefas_projeto t
             JOIN projetos p ON t.projeto_id = p.id
-            GROUP BY t.descricao
-            ORDER BY receita_total DESC
-            LIMIT 1
+            LEFT JOIN catalogo_servicos c ON c.id = t.servico_id
         """
-        self.cursor.execute(query)
-        res = self.cursor.fetchone()
-        if res:
-            return res[0], res[1] # Name, Total Revenue
-        return None, 0.0
+        where_clauses, params = self._compile_date_filter(*self._period_filters(period), column="p.data_criacao")
+        if where_clauses:
+            query += " WHERE " + " AND ".join(where_clauses)
+        query += " GROUP BY COALESCE(t.servico_id, t.descricao) ORDER BY receita_total DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        cursor.execute(query, params)
+        ranking = []
+        for nome, receita, horas in cursor.fetchall():
+            horas = horas or 0.0
+            valor_hora = (receita or 0.0) / horas if horas > 0 else 0.0
+            ranking.append((nome, receita, horas, valor_hora))
+        return ranking
 
     # Métodos de Custos Operacionais
     def get_custos_operacionais(self):
-        self.cursor.execute("SELECT id, descricao, valor FROM custos_operacionais ORDER BY descricao")
-        return self.cursor.fetchall()
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id, descricao, valor FROM custos_operacionais ORDER BY descricao")
+        return cursor.fetchall()
 
     def add_custo_operacional(self, descricao, valor):
-        self.cursor.execute("INSERT INTO custos_operacionais (descricao, valor) VALUES (?, ?)", (descricao, valor))
-        self.conn.commit()
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO custos_operacionais (descricao, valor) VALUES (?, ?)", (descricao, valor))
+        self.commit()
+        self.invalidate_config_cache()
 
     def delete_custo_operacional(self, id_custo):
-        self.cursor.execute("DELETE FROM custos_operacionais WHERE id=?", (id_custo,))
-        self.conn.commit()
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM custos_operacionais WHERE id=?", (id_custo,))
+        self.commit()
+        self.invalidate_config_cache()
 
     def get_total_custos_operacionais(self):
-        self.cursor.execute("SELECT SUM(valor) FROM custos_operacionais")
-        result = self.cursor.fetchone()[0]
-        return result if result else 0.0
+        return self._pricing_inputs()[1]
 
     def get_dashboard_metrics(self, filtro_mes=None, filtro_ano=None, filtro_dia=None):
-        query = "SELECT COUNT(*), SUM(preco_final) FROM projetos"
-        params = []
-
-        where_clauses = []
-        if filtro_mes and filtro_mes != "Todos":
-             where_clauses.append("strftime('%m', data_criacao) = ?")
-             params.append(filtro_mes)
-
-        if filtro_ano and filtro_ano != "Todos":
-             where_clauses.append("strftime('%Y', data_criacao) = ?")
-             params.append(filtro_ano)
-
-        if filtro_dia:
-             where_clauses.append("strftime('%d', data_criacao) = ?")
-             params.append(filtro_dia)
+        cursor = self.conn.cursor()
+        src, where_clauses, params = self._metrics_source(filtro_mes, filtro_ano, filtro_dia)
+        query = f"SELECT {src['qtd']}, {src['receita']} FROM {src['tabela']}"
 
         if where_clauses:
             query += " WHERE " + " AND ".join(where_clauses)
 
-        self.cursor.execute(query, params)
-        data = self.cursor.fetchone()
+        cursor.execute(query, params)
+        data = cursor.fetchone()
 
         total_projetos = data[0] if data[0] else 0
         total_orcado = data[1] if data[1] else 0.0
@@ -337,13 +1168,13 @@ class Database:
         ticket_medio = total_orcado / total_projetos if total_projetos > 0 else 0.0
 
         # Get Status Distribution for Pie Chart
-        query_status = "SELECT status, COUNT(*) FROM projetos"
+        query_status = f"SELECT {src['status']}, {src['qtd']} FROM {src['tabela']}"
         if where_clauses:
             query_status += " WHERE " + " AND ".join(where_clauses)
-        query_status += " GROUP BY status"
+        query_status += f" GROUP BY {src['status']}"
 
-        self.cursor.execute(query_status, params)
-        status_dist = self.cursor.fetchall()
+        cursor.execute(query_status, params)
+        status_dist = cursor.fetchall()
 
         return {
             "total_projetos": total_projetos,
@@ -352,10 +1183,135 @@ class Database:
             "status_dist": status_dist
         }
 
-    def get_revenue_trend(self, months=6):
-        today = datetime.datetime.now()
-        labels = []
-        values = []
+    def _period_filters(self, period, now=None):
+        # Traduz o filtro da Home ("Todos", "Este Mês", "Este Ano", "Hoje") em (mes, ano, dia)
+        now = now or datetime.datetime.now()
+        if period == "Este Mês":
+            return now.strftime("%m"), now.strftime("%Y"), None
+        if period == "Este Ano":
+            return None, now.strftime("%Y"), None
+        if period == "Hoje":
+            return now.strftime("%m"), now.strftime("%Y"), now.strftime("%d")
+        return None, None, None
+
+    def _snapshot_rows_rollup(self, periodo, now):
+        # Uma leitura de 'resumo_mensal' com agregação condicional: período, mês atual e horas
+        cursor = self.conn.cursor()
+        where_p, params_p = self._rollup_filter(*periodo)
+        no_periodo = " AND ".join(where_p) if where_p else "1"
+
+        cursor.execute(f"""
+            SELECT NULLIF(status, ''), NULLIF(categoria, ''),
+                   SUM(CASE WHEN {no_periodo} THEN qtd_projetos ELSE 0 END),
+                   SUM(CASE WHEN {no_periodo} THEN receita ELSE 0 END) / 100.0,
+                   SUM(CASE WHEN ano = ? AND mes = ? THEN receita ELSE 0 END) / 100.0,
+                   SUM(CASE WHEN {no_periodo} THEN horas ELSE 0 END)
+            FROM resumo_mensal
+            GROUP BY status, categoria
+        """, params_p * 2 + [now.year, now.month] + params_p)
+        rows = cursor.fetchall()
+        horas_totais = sum(r[5] or 0.0 for r in rows)
+        return [r[:5] for r in rows], horas_totais
+
+    def _snapshot_rows_raw(self, periodo, now):
+        # Filtros por dia não cabem no resumo mensal: duas varreduras de 'projetos' por intervalo
+        cursor = self.conn.cursor()
+        bounds_periodo = self._date_bounds(*periodo)
+        bounds_mes = self._date_bounds(now.strftime("%m"), now.strftime("%Y"))
+
+        # A varredura cobre a união do período com o mês atual (a meta é sempre mensal).
+        # Os períodos da Home são aninhados, então a união é um único intervalo.
+        if bounds_periodo is None:
+            where_scan, params_scan = "", []
+            no_periodo, params_periodo = "1", []
+        else:
+            inicio = min(bounds_periodo[0], bounds_mes[0])
+            fim = max(bounds_periodo[1], bounds_mes[1])
+            where_scan, params_scan = " WHERE data_criacao >= ? AND data_criacao < ?", [inicio, fim]
+            no_periodo, params_periodo = "(data_criacao >= ? AND data_criacao < ?)", list(bounds_periodo)
+
+        query = f"""
+            SELECT status, categoria,
+                   SUM(CASE WHEN {no_periodo} THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN {no_periodo} THEN preco_final ELSE 0 END) / 100.0,
+                   SUM(CASE WHEN data_criacao >= ? AND data_criacao < ? THEN preco_final ELSE 0 END) / 100.0
+            FROM projetos{where_scan}
+            GROUP BY status, categoria
+        """
+        cursor.execute(query, params_periodo * 2 + list(bounds_mes) + params_scan)
+        rows = cursor.fetchall()
+
+        # Horas vendidas no período (tarefas filtradas pela data de criação do projeto)
+        where_h, params_h = self._compile_date_filter(*periodo, column="p.data_criacao")
+        query_hours = "SELECT SUM(t.horas_estimadas) FROM tarefas_projeto t JOIN projetos p ON t.projeto_id = p.id"
+        if where_h:
+            query_hours += " WHERE " + " AND ".join(where_h)
+        cursor.execute(query_hours, params_h)
+        horas_totais = cursor.fetchone()[0] or 0.0
+        return rows, horas_totais
+
+    def get_dashboard_snapshot(self, period="Todos"):
+        # Tudo que a Home precisa de uma vez (agregação condicional sobre 'resumo_mensal'),
+        # no lugar de get_dashboard_metrics x2 + conversão + eficiência + categorias.
+        now = datetime.datetime.now()
+        periodo = self._period_filters(period, now)
+
+        if self._rollup_filter(*periodo) is not None:
+            rows, horas_totais = self._snapshot_rows_rollup(periodo, now)
+        else:
+            rows, horas_totais = self._snapshot_rows_raw(periodo, now)
+
+        total_projetos, total_orcado, convertidos, faturamento_mes = 0, 0.0, 0, 0.0
+        status_dist, receita_cat = {}, {}
+        for status, categoria, qtd, receita, receita_mes in rows:
+            faturamento_mes += receita_mes or 0.0
+            if not qtd:
+                continue
+            total_projetos += qtd
+            total_orcado += receita or 0.0
+            if status is not None and status != 'Orçamento':
+                convertidos += qtd
+            status_dist[status] = status_dist.get(status, 0) + qtd
+            receita_cat[categoria] = receita_cat.get(categoria, 0.0) + (receita or 0.0)
+
+        # cfg: id, custo, horas, imposto, lucro, meta, nome
+        cfg = self.get_config()
+        horas_mensais = cfg[2] if cfg else 0
+        custo_operacional_total = self.get_total_custos_operacionais()
+
+        return DashboardSnapshot(
+            periodo=period,
+            total_projetos=total_projetos,
+            total_orcado=total_orcado,
+            ticket_medio=total_orcado / total_projetos if total_projetos > 0 else 0.0,
+            total_convertidos=convertidos,
+            status_dist=tuple(status_dist.items()),
+            receita_por_categoria=tuple(receita_cat.items()),
+            horas_totais=horas_totais,
+            valor_hora_real=total_orcado / horas_totais if horas_totais > 0 else 0.0,
+            custo_hora_tecnica=custo_operacional_total / horas_mensais if horas_mensais > 0 else 0.0,
+            faturamento_mes=faturamento_mes,
+            meta_mensal=cfg[5] if cfg and len(cfg) > 5 else 10000.0,
+            nome_usuario=cfg[6] if cfg and len(cfg) > 6 else "Usuário",
+        )
+
+    # Chave SQL de cada granularidade do gráfico de tendência (início da semana = segunda-feira)
+    TREND_BUCKETS = {
+        "week": "date(data_criacao, 'weekday 0', '-6 days')",
+        "month": "substr(data_criacao, 1, 7)",
+        "quarter": "substr(data_criacao, 1, 4) || '-T' || ((CAST(substr(data_criacao, 6, 2) AS INTEGER) + 2) / 3)",
+    }
+    TREND_BREAKDOWNS = ("categoria", "status")
+    # Mesmas chaves calculadas sobre 'resumo_mensal' (semanas não cabem no resumo mensal)
+    ROLLUP_TREND_BUCKETS = {
+        "month": "printf('%04d-%02d', ano, mes)",
+        "quarter": "ano || '-T' || ((mes + 2) / 3)",
+    }
+
+    def _trend_buckets(self, months, bucket, today=None):
+        # Lista [(chave, rótulo)] de todos os baldes da janela, na mesma forma das chaves SQL,
+        # e o intervalo [inicio, fim) coberto por eles.
+        today = today or datetime.date.today()
 
         # Helper to subtract months
         def subtract_months(dt, n):
@@ -364,104 +1320,187 @@ class Database:
             month = total_months % 12 + 1
             return datetime.date(year, month, 1)
 
-        for i in range(months - 1, -1, -1):
-            d = subtract_months(today, i)
-            month_str = d.strftime("%Y-%m")
-            label_str = d.strftime("%b/%y") # Ex: Out/23
-
-            self.cursor.execute("SELECT SUM(preco_final) FROM projetos WHERE strftime('%Y-%m', data_criacao) = ?", (month_str,))
-            res = self.cursor.fetchone()
-            val = res[0] if res and res[0] else 0.0
-
-            labels.append(label_str)
-            values.append(val)
-
-        return labels, values
+        def add_months(dt, n):
+            return subtract_months(dt, -n)
+
+        inicio = subtract_months(today, months - 1)
+        buckets = []
+
+        if bucket == "week":
+            inicio = inicio - datetime.timedelta(days=inicio.weekday())
+            d = inicio
+            while d <= today:
+                buckets.append((d.isoformat(), d.strftime("%d/%m")))
+                d += datetime.timedelta(days=7)
+            return buckets, inicio.isoformat(), d.isoformat()
+
+        if bucket == "quarter":
+            inicio = datetime.date(inicio.year, (inicio.month - 1) // 3 * 3 + 1, 1)
+            d = inicio
+            while d <= today:
+                tri = (d.month - 1) // 3 + 1
+                buckets.append((f"{d.year}-T{tri}", f"T{tri}/{d.strftime('%y')}"))
+                d = add_months(d, 3)
+            return buckets, inicio.isoformat(), d.isoformat()
+
+        d = inicio
+        while d <= today:
+            buckets.append((d.strftime("%Y-%m"), d.strftime("%b/%y"))) # Ex: Out/23
+            d = add_months(d, 1)
+        return buckets, inicio.isoformat(), d.isoformat()
+
+    def get_revenue_trend(self, months=6, bucket="month", breakdown=None):
+        # Faturamento dos últimos `months` meses agrupado por semana/mês/trimestre, em uma única
+        # consulta (mês/trimestre leem 'resumo_mensal'; semana usa o índice de data_criacao).
+        # Baldes vazios são zerados aqui.
+        # Sem breakdown: (labels, values). Com breakdown ("categoria" ou "status"):
+        # (labels, {serie: values}).
+        cursor = self.conn.cursor()
+        if bucket not in self.TREND_BUCKETS:
+            raise ValueError(f"Granularidade inválida: {bucket}")
+        if breakdown is not None and breakdown not in self.TREND_BREAKDOWNS:
+            raise ValueError(f"Quebra inválida: {breakdown}")
+
+        buckets, inicio, fim = self._trend_buckets(months, bucket)
+        labels = [label for _, label in buckets]
+        index = {key: i for i, (key, _) in enumerate(buckets)}
+
+        if bucket in self.ROLLUP_TREND_BUCKETS:
+            key_sql = self.ROLLUP_TREND_BUCKETS[bucket]
+            serie_sql = f"NULLIF({breakdown}, '')" if breakdown else "NULL"
+            cursor.execute(f"""
+                SELECT {key_sql}, {serie_sql}, SUM(receita) / 100.0
+                FROM resumo_mensal
+                WHERE ano * 100 + mes >= ? AND ano * 100 + mes < ?
+                GROUP BY 1, 2
+            """, (int(inicio[:4]) * 100 + int(inicio[5:7]), int(fim[:4]) * 100 + int(fim[5:7])))
+        else:
+            key_sql = self.TREND_BUCKETS[bucket]
+            serie_sql = breakdown if breakdown else "NULL"
+            cursor.execute(f"""
+                SELECT {key_sql}, {serie_sql}, SUM(preco_final) / 100.0
+                FROM projetos
+                WHERE data_criacao >= ? AND data_criacao < ?
+                GROUP BY 1, 2
+            """, (inicio, fim))
+        rows = cursor.fetchall()
+
+        if not breakdown:
+            values = [0.0] * len(buckets)
+            for key, _, total in rows:
+                if key in index:
+                    values[index[key]] += total or 0.0
+            return labels, values
+
+        series = {}
+        for key, serie, total in rows:
+            if key not in index:
+                continue
+            values = series.setdefault(serie, [0.0] * len(buckets))
+            values[index[key]] += total or 0.0
+        return labels, series
 
     def get_revenue_by_category(self, filtro_mes=None, filtro_ano=None, filtro_dia=None):
-        query = "SELECT categoria, SUM(preco_final) FROM projetos"
-        params = []
-        where_clauses = []
-
-        if filtro_mes and filtro_mes != "Todos":
-             where_clauses.append("strftime('%m', data_criacao) = ?")
-             params.append(filtro_mes)
-
-        if filtro_ano and filtro_ano != "Todos":
-             where_clauses.append("strftime('%Y', data_criacao) = ?")
-             params.append(filtro_ano)
-
-        if filtro_dia:
-             where_clauses.append("strftime('%d', data_criacao) = ?")
-             params.append(filtro_dia)
+        cursor = self.conn.cursor()
+        src, where_clauses, params = self._metrics_source(filtro_mes, filtro_ano, filtro_dia)
+        query = f"SELECT {src['categoria']}, {src['receita']} FROM {src['tabela']}"
 
         if where_clauses:
             query += " WHERE " + " AND ".join(where_clauses)
 
-        query += " GROUP BY categoria"
+        query += f" GROUP BY {src['categoria']}"
 
-        self.cursor.execute(query, params)
-        return self.cursor.fetchall() # [(Cat, Val), ...]
+        cursor.execute(query, params)
+        return cursor.fetchall() # [(Cat, Val), ...]
 
     def get_conversion_rate(self, filtro_mes=None, filtro_ano=None, filtro_dia=None):
+        cursor = self.conn.cursor()
         # Total Budgets = Count All
         # Converted = Status != 'Orçamento' (assuming 'Orçamento' is the initial state)
         # OR Status in ('Aprovado', 'Em Execução', 'Concluído')
 
-        base_query = "SELECT COUNT(*) FROM projetos"
-        params = []
-        where_clauses = []
-
-        if filtro_mes and filtro_mes != "Todos":
-             where_clauses.append("strftime('%m', data_criacao) = ?")
-             params.append(filtro_mes)
-
-        if filtro_ano and filtro_ano != "Todos":
-             where_clauses.append("strftime('%Y', data_criacao) = ?")
-             params.append(filtro_ano)
-
-        if filtro_dia:
-             where_clauses.append("strftime('%d', data_criacao) = ?")
-             params.append(filtro_dia)
+        src, where_clauses, params = self._metrics_source(filtro_mes, filtro_ano, filtro_dia)
+        base_query = f"SELECT {src['qtd']} FROM {src['tabela']}"
 
         where_str = ""
         if where_clauses:
             where_str = " WHERE " + " AND ".join(where_clauses)
 
         # Total
-        self.cursor.execute(base_query + where_str, params)
-        total = self.cursor.fetchone()[0]
+        cursor.execute(base_query + where_str, params)
+        total = cursor.fetchone()[0]
         if not total: total = 0
 
         # Converted
         converted_clauses = list(where_clauses)
-        converted_clauses.append("status != 'Orçamento'")
+        converted_clauses.append(f"{src['status']} != 'Orçamento'")
         where_converted = " WHERE " + " AND ".join(converted_clauses)
 
-        self.cursor.execute(base_query + where_converted, params)
-        converted = self.cursor.fetchone()[0]
+        cursor.execute(base_query + where_converted, params)
+        converted = cursor.fetchone()[0]
         if not converted: converted = 0
 
         return total, converted
 
-    def get_stalled_projects(self, days=10):
-        # Projects not updated in X days and NOT 'Concluído'
-        # We need to be careful with date parsing.
-        # Ideally we assume data_atualizacao is sortable string YYYY-MM-DD...
-
-        limit_date = datetime.datetime.now() - datetime.timedelta(days=days)
-        # Convert to string format used in DB. Since we might have YYYY-MM-DD or YYYY-MM-DD HH:MM:SS
-        # If we use string comparison, "2023-10-01" < "2023-10-10".
-        # We need to handle that data_atualizacao might vary.
-        # But let's assume standard ISO format YYYY-MM-DD...
+    def get_status_funnel(self, filtro_mes=None, filtro_ano=None, filtro_dia=None):
+        """Funil dos projetos criados no período, a partir de status_historico.
 
-        limit_str = limit_date.strftime("%Y-%m-%d %H:%M:%S")
-
-        # We want data_atualizacao < limit_str
-        # AND status != 'Concluído'
+        Retorna [(status, projetos que chegaram a ele ou além, % do total, média de dias no status)]
+        na ordem de STATUS_VALUES. A média só conta passagens encerradas (com uma troca depois);
+        o status inicial de cada projeto começa na data de criação.
+        """
+        cursor = self.conn.cursor()
+        ordem_sql = "CASE status " + " ".join(f"WHEN '{s}' THEN {i}" for i, s in enumerate(STATUS_VALUES)) + " END"
+        where_clauses, params = self._compile_date_filter(filtro_mes, filtro_ano, filtro_dia, column="p.data_criacao")
+        where_clauses = ["p.data_criacao IS NOT NULL"] + where_clauses
+
+        # Passagens por status: uma linha por entrada num status (a criação e cada troca), com a duração
+        # até a próxima (LEAD) e o status mais adiantado que o projeto já alcançou (MAX na mesma partição)
+        cursor.execute(f"""
+            WITH coorte AS (
+                SELECT p.id, p.status, p.data_criacao FROM projetos p WHERE {" AND ".join(where_clauses)}
+            ),
+            trocas AS (
+                SELECT h.id, h.projeto_id, h.de, h.para, h.timestamp,
+                       ROW_NUMBER() OVER (PARTITION BY h.projeto_id ORDER BY h.timestamp, h.id) AS n
+                FROM status_historico h JOIN coorte c ON c.id = h.projeto_id
+            ),
+            eventos AS (
+                SELECT c.id AS projeto_id, IFNULL(t.de, c.status) AS status, julianday(c.data_criacao) AS inicio, 0 AS seq
+                FROM coorte c LEFT JOIN trocas t ON t.projeto_id = c.id AND t.n = 1
+                UNION ALL
+                SELECT projeto_id, para, julianday(timestamp, 'unixepoch', 'localtime'), id FROM trocas
+            ),
+            etapas AS (
+                SELECT projeto_id, status, {ordem_sql} AS ordem,
+                       LEAD(inicio) OVER (PARTITION BY projeto_id ORDER BY inicio, seq) - inicio AS dias,
+                       MAX({ordem_sql}) OVER (PARTITION BY projeto_id) AS max_ordem
+                FROM eventos
+            )
+            SELECT status, AVG(dias),
+                   SUM(COUNT(DISTINCT CASE WHEN ordem = max_ordem THEN projeto_id END)) OVER (ORDER BY ordem DESC)
+            FROM etapas
+            WHERE ordem IS NOT NULL
+            GROUP BY ordem
+        """, params)
+        por_status = {status: (dias, alcancaram) for status, dias, alcancaram in cursor.fetchall()}
+
+        funil, alcancaram = [], 0
+        for status in reversed(STATUS_VALUES):
+            # Um status sem passagens ainda conta quem chegou aos seguintes
+            dias, alcancaram = por_status.get(status, (None, alcancaram))
+            funil.append([status, alcancaram, 0.0, dias])
+        funil.reverse()
+        total = funil[0][1]
+        for etapa in funil:
+            etapa[2] = etapa[1] / total * 100 if total else 0.0
+        return [tuple(etapa) for etapa in funil]
 
-        # Note: If data_atualizacao is YYYY-MM-DD (length 10), and limit_str is length 19, string compare still works often
-        # but "2023-10-20" < "2023-10-20 12:00:00" is true.
+    def get_stalled_projects(self, days=10):
+        cursor = self.conn.cursor()
+        # Projects not updated in X days and NOT 'Concluído'.
+        # data_atualizacao é época (inteiro): a comparação usa o índice (status, data_atualizacao)
+        limite = to_epoch(datetime.datetime.now() - datetime.timedelta(days=days))
 
         query = """
             SELECT id, cliente, status, data_atualizacao
@@ -470,70 +1509,51 @@ class Database:
             AND (data_atualizacao < ? OR data_atualizacao IS NULL)
         """
 
-        self.cursor.execute(query, (limit_str,))
-        return self.cursor.fetchall()
+        cursor.execute(query, (limite,))
+        return [(pid, cliente, status, from_epoch(atualizado)) for pid, cliente, status, atualizado in cursor.fetchall()]
 
-    def get_hourly_efficiency(self, filtro_mes=None, filtro_ano=None, filtro_dia=None):
-        # 1. Calculate Real Sold Hour Value
+    def get_sold_hourly_rate(self, filtro_mes=None, filtro_ano=None, filtro_dia=None):
+        # Receita / horas vendidas no período: só o histórico, sem nada da configuração
+        cursor = self.conn.cursor()
         # Avoid JOIN duplication by querying separately
 
         # Total Revenue
-        query_rev = "SELECT SUM(preco_final) FROM projetos"
-        params = []
-        where_clauses = []
-
-        if filtro_mes and filtro_mes != "Todos":
-             where_clauses.append("strftime('%m', data_criacao) = ?")
-             params.append(filtro_mes)
-
-        if filtro_ano and filtro_ano != "Todos":
-             where_clauses.append("strftime('%Y', data_criacao) = ?")
-             params.append(filtro_ano)
-
-        if filtro_dia:
-             where_clauses.append("strftime('%d', data_criacao) = ?")
-             params.append(filtro_dia)
+        src, where_clauses, params = self._metrics_source(filtro_mes, filtro_ano, filtro_dia)
+        query_rev = f"SELECT {src['receita']} FROM {src['tabela']}"
 
         if where_clauses:
             query_rev += " WHERE " + " AND ".join(where_clauses)
 
-        self.cursor.execute(query_rev, params)
-        res_rev = self.cursor.fetchone()
+        cursor.execute(query_rev, params)
+        res_rev = cursor.fetchone()
         total_rev = res_rev[0] if res_rev and res_rev[0] else 0.0
 
         # Total Hours
         # We need to filter tasks by the creation date of their PROJECT.
-        query_hours = """
-            SELECT SUM(t.horas_estimadas)
-            FROM tarefas_projeto t
-            JOIN projetos p ON t.projeto_id = p.id
-        """
-        # Re-use where clauses but with 'p.' prefix if needed, but since we didn't use alias in where_clauses above,
-        # we need to be careful. 'data_criacao' exists in projects.
-        # Let's rebuild params/clauses with alias 'p'
-
-        params_h = []
-        where_h = []
-        if filtro_mes and filtro_mes != "Todos":
-             where_h.append("strftime('%m', p.data_criacao) = ?")
-             params_h.append(filtro_mes)
-
-        if filtro_ano and filtro_ano != "Todos":
-             where_h.append("strftime('%Y', p.data_criacao) = ?")
-             params_h.append(filtro_ano)
-
-        if filtro_dia:
-             where_h.append("strftime('%d', p.data_criacao) = ?")
-             params_h.append(filtro_dia)
+        if src["tabela"] == "resumo_mensal":
+            query_hours = "SELECT SUM(horas) FROM resumo_mensal"
+            where_h, params_h = where_clauses, params
+        else:
+            query_hours = """
+                SELECT SUM(t.horas_estimadas)
+                FROM tarefas_projeto t
+                JOIN projetos p ON t.projeto_id = p.id
+            """
+            # Mesmo filtro, com o alias 'p'
+            where_h, params_h = self._compile_date_filter(filtro_mes, filtro_ano, filtro_dia, column="p.data_criacao")
 
         if where_h:
             query_hours += " WHERE " + " AND ".join(where_h)
 
-        self.cursor.execute(query_hours, params_h)
-        res_hours = self.cursor.fetchone()
+        cursor.execute(query_hours, params_h)
+        res_hours = cursor.fetchone()
         total_hours = res_hours[0] if res_hours and res_hours[0] else 0.0
 
-        real_hourly_rate = total_rev / total_hours if total_hours > 0 else 0.0
+        return total_rev / total_hours if total_hours > 0 else 0.0
+
+    def get_hourly_efficiency(self, filtro_mes=None, filtro_ano=None, filtro_dia=None):
+        # 1. Calculate Real Sold Hour Value
+        real_hourly_rate = self.get_sold_hourly_rate(filtro_mes, filtro_ano, filtro_dia)
 
         # 2. Get Technical Cost (Calculated from Config)
         # We need logic to calc technical cost. Logic class has it.
@@ -554,89 +1574,333 @@ class Database:
 
         return real_hourly_rate, tech_hourly_cost
 
-    def search_projects(self, query=None, sort_by=None):
-        sql = "SELECT id, cliente, data_entrega, status, preco_final, data_atualizacao, categoria FROM projetos"
-        params = []
-        where_clauses = []
+    # Modo de ordenação da lista -> (chave SQL, chave decrescente?, id decrescente?).
+    # O id desempata a chave, o que torna a ordem total e permite paginar por cursor (chave, id).
+    PROJECT_SORTS = {
+        "Maior": ("p.preco_final", True, True),
+        "Menor": ("p.preco_final", False, False),
+        "Recente": ("p.data_atualizacao", True, True),
+        "Antigo": ("p.data_atualizacao", False, False),
+        "Relev": ("f.fts_rank", False, True),
+    }
+
+    def _project_search_source(self, query):
+        # FROM + WHERE da busca de projetos: (from_sql, where_clauses, params, has_rank)
+        plan = compile_search((query or "").strip(), self.fts_enabled)
+        return "FROM projetos p" + plan.joins, list(plan.where), plan.bind(), plan.has_rank
+
+    def _project_sort(self, sort_by, has_rank):
+        for prefix, spec in self.PROJECT_SORTS.items():
+            if sort_by and prefix in sort_by and (prefix != "Relev" or has_rank):
+                return spec
+        return None, False, True  # p.id DESC
+
+    def _keyset_clause(self, key, key_desc, id_desc, after):
+        # Condição "vem depois de (chave, id)" na ordem dada. NULLs ficam no início em ASC e no fim em DESC.
+        cursor = self.conn.cursor()
+        sort_val, last_id = after
+        id_op = "<" if id_desc else ">"
+        if key is None:
+            return f"p.id {id_op} ?", [last_id]
+        if sort_val is None:
+            clause = f"({key} IS NULL AND p.id {id_op} ?)"
+            return (clause if key_desc else f"({clause} OR {key} IS NOT NULL)"), [last_id]
+
+        op = "<" if key_desc else ">"
+        if key_desc == id_desc:
+            # Comparação de row values: vira uma busca por intervalo no índice
+            clause, params = f"({key}, p.id) {op} (?, ?)", [sort_val, last_id]
+        else:
+            clause, params = f"({key} {op} ? OR ({key} = ? AND p.id {id_op} ?))", [sort_val, sort_val, last_id]
+        if key_desc:
+            # Só inclui os NULLs (fim da ordem) se existirem: o OR impediria a busca por intervalo
+            cursor.execute(f"SELECT EXISTS(SELECT 1 FROM projetos p WHERE {key} IS NULL)")
+            if cursor.fetchone()[0]:
+                clause = f"({clause} OR {key} IS NULL)"
+        return clause, params
+
+    def search_projects_page(self, query=None, sort_by=None, limit=50, after=None):
+        """Uma página da busca de projetos, ordenada por sort_by.
+
+        Retorna (linhas, cursor): passe o cursor em 'after' para buscar a página seguinte;
+        ele é None quando não há mais resultados. limit=None traz tudo de uma vez.
+        """
+        cursor = self.conn.cursor()
+        from_sql, where_clauses, params, has_rank = self._project_search_source(query)
+        key, key_desc, id_desc = self._project_sort(sort_by, has_rank)
 
-        if query:
-            query = query.strip()
-            # Check for operators
-            if query.startswith((">=", "<=", ">", "<", "=")):
-                # Extract operator and number
-                match = re.match(r"(>=|<=|>|<|=)\s*(\d+(\.\d+)?)", query)
-                if match:
-                    op, val = match.groups()[0], float(match.groups()[1])
-                    where_clauses.append(f"preco_final {op} ?")
-                    params.append(val)
-                else:
-                    # Fallback to text if parsing fails
-                    where_clauses.append("(cliente LIKE ? OR categoria LIKE ? OR CAST(id AS TEXT) LIKE ?)")
-                    params.extend([f"%{query}%", f"%{query}%", f"%{query}%"])
-            else:
-                 where_clauses.append("(cliente LIKE ? OR categoria LIKE ? OR CAST(id AS TEXT) LIKE ?)")
-                 params.extend([f"%{query}%", f"%{query}%", f"%{query}%"])
+        if after is not None:
+            clause, clause_params = self._keyset_clause(key, key_desc, id_desc, after)
+            where_clauses.append(clause)
+            params.extend(clause_params)
 
+        sql = f"SELECT p.id, p.cliente, p.data_entrega, p.status, p.preco_final, p.data_atualizacao, p.categoria, {key or 'NULL'} {from_sql}"
         if where_clauses:
             sql += " WHERE " + " AND ".join(where_clauses)
 
-        # Sorting
-        if sort_by:
-            if "Maior" in sort_by:
-                sql += " ORDER BY preco_final DESC"
-            elif "Menor" in sort_by:
-                sql += " ORDER BY preco_final ASC"
-            elif "Recente" in sort_by:
-                sql += " ORDER BY data_atualizacao DESC"
-            elif "Antigo" in sort_by:
-                sql += " ORDER BY data_atualizacao ASC"
-            else:
-                sql += " ORDER BY id DESC"
-        else:
-            sql += " ORDER BY id DESC"
+        order = [f"{key} {'DESC' if key_desc else 'ASC'}"] if key else []
+        order.append(f"p.id {'DESC' if id_desc else 'ASC'}")
+        sql += " ORDER BY " + ", ".join(order)
+        if limit is not None:
+            # Uma linha a mais só para saber se existe próxima página
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            # O cursor fica no formato gravado (centavos, época), que é o que a comparação usa
+            next_cursor = (rows[-1][7], rows[-1][0])
+        return [(pid, cliente, from_iso_date(entrega), status, from_cents(preco), from_epoch(atualizado), categoria)
+                for pid, cliente, entrega, status, preco, atualizado, categoria, _ in rows], next_cursor
+
+    def search_projects(self, query=None, sort_by=None):
+        return self.search_projects_page(query, sort_by, limit=None)[0]
 
-        self.cursor.execute(sql, params)
-        return self.cursor.fetchall()
+    def get_search_summary(self, query=None):
+        # (quantidade, soma de preco_final) de todos os projetos que casam com a busca
+        cursor = self.conn.cursor()
+        from_sql, where_clauses, params, _ = self._project_search_source(query)
+        sql = f"SELECT COUNT(*), TOTAL(p.preco_final) / 100 {from_sql}"
+        if where_clauses:
+            sql += " WHERE " + " AND ".join(where_clauses)
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+
+    # Limite de parâmetros '?' por comando em SQLite antigos (SQLITE_MAX_VARIABLE_NUMBER = 999)
+    MAX_VARIABLES = 900
+
+    def delete_projects(self, ids):
+        """Exclui os projetos de 'ids' (as tarefas saem por ON DELETE CASCADE). Retorna quantos saíram."""
+        cursor = self.conn.cursor()
+        ids = list(ids)
+        removidos = 0
+        with self.transaction():
+            for i in range(0, len(ids), self.MAX_VARIABLES):
+                lote = ids[i:i + self.MAX_VARIABLES]
+                cursor.execute(f"DELETE FROM projetos WHERE id IN ({', '.join('?' * len(lote))})", lote)
+                removidos += cursor.rowcount
+        return removidos
+
+    def set_status(self, ids, status):
+        """Muda o status de vários projetos numa transação. Retorna quantos mudaram.
+
+        O trigger trg_status_historico registra cada troca em status_historico.
+        """
+        cursor = self.conn.cursor()
+        ids = list(ids)
+        agora = to_epoch(datetime.datetime.now())
+        alterados = 0
+        with self.transaction():
+            for i in range(0, len(ids), self.MAX_VARIABLES):
+                lote = ids[i:i + self.MAX_VARIABLES]
+                cursor.execute(f"""
+                    UPDATE projetos SET status = ?, data_atualizacao = ?
+                    WHERE status IS NOT ? AND id IN ({', '.join('?' * len(lote))})
+                """, [status, agora, status] + lote)
+                alterados += cursor.rowcount
+        return alterados
+
+    def delete_matching_projects(self, query=None, todos=False):
+        # Exclui de uma vez todos os projetos que casam com a busca (o mesmo filtro de get_search_summary).
+        # Uma busca sem filtro casa com tudo: apagar todos os projetos só com todos=True explícito.
+        cursor = self.conn.cursor()
+        from_sql, where_clauses, params, _ = self._project_search_source(query)
+        if not where_clauses and from_sql == "FROM projetos p" and not todos:
+            raise ValueError("Busca sem filtro: use todos=True para excluir todos os projetos")
+        sql = f"SELECT p.id {from_sql}"
+        if where_clauses:
+            sql += " WHERE " + " AND ".join(where_clauses)
+        with self.transaction():
+            cursor.execute(f"DELETE FROM projetos WHERE id IN ({sql})", params)
+        return cursor.rowcount
+
+    # Colunas copiadas por duplicate_projects; as que não estão em CLONE_DEFAULTS vêm iguais ao original.
+    # horas_totais fica de fora: os triggers de tarefas_projeto somam as horas das tarefas copiadas.
+    CLONE_COLUMNS = ("cliente", "data_criacao", "data_entrega", "status", "custo_extras", "preco_final",
+                     "categoria", "data_atualizacao", "desconto_texto")
+    CLONE_DEFAULTS = {
+        "cliente": "p.cliente || ' (Cópia)'",
+        "status": "'Orçamento'",
+        "data_criacao": ":hoje",
+        "data_atualizacao": ":agora",
+    }
+
+    # Valor do Python -> formato gravado, por coluna de 'projetos'
+    COLUMN_ADAPTERS = {
+        "data_entrega": to_iso_date,
+        "custo_extras": to_cents,
+        "preco_final": to_cents,
+        "data_atualizacao": to_epoch,
+    }
+
+    def get_project(self, projeto_id):
+        # (id, cliente, data_criacao, data_entrega, status, custo_extras, preco_final, categoria,
+        #  data_atualizacao, desconto_texto, horas_totais), com dinheiro em float e datas em date/datetime
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT id, cliente, data_criacao, data_entrega, status, custo_extras, preco_final, categoria,
+                   data_atualizacao, desconto_texto, horas_totais
+            FROM projetos WHERE id=?
+        """, (projeto_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        (pid, cliente, criado, entrega, status, extras, preco, categoria, atualizado, desconto, horas) = row
+        return (pid, cliente, criado, from_iso_date(entrega), status, from_cents(extras), from_cents(preco),
+                categoria, from_epoch(atualizado), desconto, horas)
+
+    def add_project(self, cliente, data_entrega, custo_extras, preco_final, categoria, desconto_texto, tarefas):
+        # Novo orçamento com suas tarefas [(descricao, horas, servico_id)], numa transação. Valores como
+        # saem da UI (dinheiro em float, entrega date ou None); a conversão para o formato gravado é daqui.
+        # Retorna o id do projeto.
+        cursor = self.conn.cursor()
+        agora = datetime.datetime.now()
+        with self.transaction():
+            cursor.execute("""
+                INSERT INTO projetos (cliente, data_criacao, data_entrega, status, custo_extras, preco_final, categoria, data_atualizacao, desconto_texto)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (cliente, agora.strftime("%Y-%m-%d"), to_iso_date(data_entrega), "Orçamento", to_cents(custo_extras),
+                  to_cents(preco_final), categoria, to_epoch(agora), desconto_texto))
+            projeto_id = cursor.lastrowid
+            cursor.executemany("INSERT INTO tarefas_projeto (projeto_id, descricao, horas_estimadas, servico_id) VALUES (?, ?, ?, ?)",
+                               ((projeto_id, descricao, horas, sid) for descricao, horas, sid in tarefas))
+        return projeto_id
+
+    def update_project(self, projeto_id, cliente, data_entrega, custo_extras, preco_final, categoria, desconto_texto, tarefas):
+        # Regrava o orçamento e troca as tarefas pelas de 'tarefas', numa transação (mesmos formatos de add_project)
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute("""
+                UPDATE projetos SET cliente=?, data_entrega=?, custo_extras=?, preco_final=?, categoria=?, data_atualizacao=?, desconto_texto=?
+                WHERE id=?
+            """, (cliente, to_iso_date(data_entrega), to_cents(custo_extras), to_cents(preco_final), categoria,
+                  to_epoch(datetime.datetime.now()), desconto_texto, projeto_id))
+            cursor.execute("DELETE FROM tarefas_projeto WHERE projeto_id=?", (projeto_id,))
+            cursor.executemany("INSERT INTO tarefas_projeto (projeto_id, descricao, horas_estimadas, servico_id) VALUES (?, ?, ?, ?)",
+                               ((projeto_id, descricao, horas, sid) for descricao, horas, sid in tarefas))
+
+    def duplicate_projects(self, ids, overrides=None):
+        """Duplica os projetos de 'ids' com suas tarefas, numa transação. Retorna {id_original: id_novo}.
+
+        As cópias voltam para 'Orçamento' com datas de hoje e " (Cópia)" no cliente; 'overrides'
+        ({coluna: valor}) troca o valor de qualquer coluna de CLONE_COLUMNS em todas as cópias
+        (dinheiro em float e datas como date/datetime, como saem de get_project).
+        """
+        overrides = overrides or {}
+        invalidas = set(overrides) - set(self.CLONE_COLUMNS)
+        if invalidas:
+            raise ValueError(f"Colunas inválidas: {', '.join(sorted(invalidas))}")
+
+        cursor = self.conn.cursor()
+        agora = datetime.datetime.now()
+        params = {"hoje": agora.strftime("%Y-%m-%d"), "agora": to_epoch(agora)}
+        valores = []
+        for col in self.CLONE_COLUMNS:
+            if col in overrides:
+                params[f"o_{col}"] = self.COLUMN_ADAPTERS.get(col, lambda v: v)(overrides[col])
+                valores.append(f":o_{col}")
+            else:
+                valores.append(self.CLONE_DEFAULTS.get(col, f"p.{col}"))
+
+        with self.transaction():
+            # Original -> id novo, atribuído aqui (como em bulk_import_projects) para copiar as tarefas
+            # com um INSERT ... SELECT só, sem um lastrowid por projeto
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS clone_ids (origem INTEGER PRIMARY KEY, novo INTEGER)")
+            cursor.execute("DELETE FROM clone_ids")
+            cursor.executemany("INSERT OR IGNORE INTO clone_ids (origem) VALUES (?)", ((i,) for i in ids))
+            cursor.execute("DELETE FROM clone_ids WHERE origem NOT IN (SELECT id FROM projetos)")
+            cursor.execute("SELECT MAX(IFNULL((SELECT MAX(id) FROM projetos), 0), IFNULL((SELECT seq FROM sqlite_sequence WHERE name='projetos'), 0))")
+            base = cursor.fetchone()[0]
+            cursor.execute("SELECT origem FROM clone_ids ORDER BY origem")
+            mapa = {origem: base + n for n, (origem,) in enumerate(cursor.fetchall(), 1)}
+            cursor.executemany("UPDATE clone_ids SET novo = ? WHERE origem = ?", ((novo, origem) for origem, novo in mapa.items()))
+            cursor.execute(f"""
+                INSERT INTO projetos (id, {', '.join(self.CLONE_COLUMNS)})
+                SELECT c.novo, {', '.join(valores)}
+                FROM clone_ids c JOIN projetos p ON p.id = c.origem
+                ORDER BY c.novo
+            """, params)
+            cursor.execute("""
+                INSERT INTO tarefas_projeto (projeto_id, descricao, horas_estimadas, servico_id)
+                SELECT c.novo, t.descricao, t.horas_estimadas, t.servico_id
+                FROM clone_ids c JOIN tarefas_projeto t ON t.projeto_id = c.origem
+                ORDER BY c.novo, t.id
+            """)
+            cursor.execute("DELETE FROM clone_ids")
+        return mapa
 
     def duplicate_project(self, original_id):
-        # 1. Fetch Original
-        self.cursor.execute("SELECT * FROM projetos WHERE id=?", (original_id,))
-        orig = self.cursor.fetchone()
-        if not orig: return
-
-        # Get column names to be safe or map manually
-        # 0:id, 1:cliente, 2:data_criacao, 3:data_entrega, 4:status, 5:custo_extras, 6:preco_final, 7:categoria, 8:data_atualizacao, 9:desconto_texto
-        # Note: If database was migrated, order might differ (appended at end).
-        # It's safer to fetch by name if we were using a DictCursor, but here we use index.
-        # Assuming append order in check_and_migrate is respected, discount is last.
-        # But for 'orig', if we select *, the order is schema order.
-
-        # To be robust against column order changes, we should probably explicitly select columns in copy.
-        # But for now, let's assume the order: id, cliente, data_criacao, data_entrega, status, custo_extras, preco_final, categoria, data_atualizacao, desconto_texto
-
-        # Check len
-        has_discount = len(orig) > 9
-        discount_val = orig[9] if has_discount else ""
-
-        new_client = orig[1] + " (Cópia)"
-        now_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        now_ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        # Copy data but reset status to 'Orçamento' and update dates
-        self.cursor.execute("""
-            INSERT INTO projetos (cliente, data_criacao, data_entrega, status, custo_extras, preco_final, categoria, data_atualizacao, desconto_texto)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (new_client, now_date, orig[3], "Orçamento", orig[5], orig[6], orig[7], now_ts, discount_val))
-
-        new_id = self.cursor.lastrowid
-
-        # 2. Copy Tasks
-        self.cursor.execute("SELECT descricao, horas_estimadas FROM tarefas_projeto WHERE projeto_id=?", (original_id,))
-        tasks = self.cursor.fetchall()
-
-        for t in tasks:
-            self.cursor.execute("INSERT INTO tarefas_projeto (projeto_id, descricao, horas_estimadas) VALUES (?, ?, ?)",
-                                (new_id, t[0], t[1]))
-
-        self.conn.commit()
-        return new_id
+        return self.duplicate_projects([original_id]).get(original_id)
+
+    def bulk_import_projects(self, projects, chunk_size=1000, progress=None):
+        """Importa projetos históricos (dicts de project_import.read_projects) com suas tarefas.
+
+        Tudo numa transação, em lotes de executemany. Os triggers derivados (resumo, horas, FTS)
+        saem durante a carga e os agregados das linhas novas são calculados uma vez no fim.
+        progress(projetos_lidos) é chamado a cada lote. Retorna (projetos, tarefas, ignorados).
+        """
+        cursor = self.conn.cursor()
+        triggers = {**ROLLUP_TRIGGERS, **HORAS_TRIGGERS, **(FTS_TRIGGERS if self.fts_enabled else {})}
+        n_projetos = n_tarefas = ignorados = lidos = 0
+
+        with self.transaction():
+            for name in triggers:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+            # Ids atribuídos aqui para ligar as tarefas sem um lastrowid por projeto
+            # (a transação já tem o lock de escrita, ninguém insere no meio)
+            cursor.execute("SELECT MAX(IFNULL((SELECT MAX(id) FROM projetos), 0), IFNULL((SELECT seq FROM sqlite_sequence WHERE name='projetos'), 0))")
+            primeiro_id = proximo_id = cursor.fetchone()[0] + 1
+
+            # Tarefas com o nome de um serviço do catálogo ficam vinculadas a ele
+            cursor.execute("SELECT nome, MIN(id) FROM catalogo_servicos GROUP BY nome")
+            servicos = dict(cursor.fetchall())
+
+            lote_p, lote_t = [], []
+
+            def gravar():
+                cursor.executemany("""
+                    INSERT INTO projetos (id, cliente, data_criacao, data_entrega, status, custo_extras, preco_final,
+                                          categoria, data_atualizacao, desconto_texto, horas_totais)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, lote_p)
+                cursor.executemany("INSERT INTO tarefas_projeto (projeto_id, descricao, horas_estimadas, servico_id) VALUES (?, ?, ?, ?)",
+                                   lote_t)
+                lote_p.clear()
+                lote_t.clear()
+                if progress: progress(lidos)
+
+            for raw in projects:
+                lidos += 1
+                try:
+                    projeto, tarefas = normalize_project(raw)
+                except ValueError:
+                    ignorados += 1
+                    continue
+
+                cliente, criado, entrega, status, extras, preco, categoria, atualizado, desconto = projeto
+                lote_p.append((proximo_id, cliente, criado, to_iso_date(entrega), status, to_cents(extras), to_cents(preco),
+                               categoria, to_epoch(atualizado), desconto, sum(h for _, h in tarefas)))
+                lote_t.extend((proximo_id, desc, horas, servicos.get(desc)) for desc, horas in tarefas)
+                proximo_id += 1
+                n_projetos += 1
+                n_tarefas += len(tarefas)
+
+                if len(lote_p) >= chunk_size or len(lote_t) >= chunk_size * 20:
+                    gravar()
+            gravar()
+
+            if n_projetos:
+                faixa = (primeiro_id, proximo_id - 1)
+                cursor.execute(_rollup_merge_sql("p.id BETWEEN ? AND ?"), faixa)
+                if self.fts_enabled:
+                    cursor.execute(_fts_insert_sql("p.id BETWEEN ? AND ?"), faixa)
+
+            for sql in triggers.values():
+                cursor.execute(sql)
+
+        return n_projetos, n_tarefas, ignorados
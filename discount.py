@@ -0,0 +1,80 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+from text_utils import parse_br_number
+
+# --- Expressões de desconto/acréscimo do orçamento ---
+# Exemplos: -10%  +R$ 500  -5% -200  x0.9  "10%" (acréscimo)  "500" (acréscimo em reais)
+#
+# A expressão é uma sequência de termos aplicados da esquerda para a direita sobre o preço sugerido:
+#   ±N%      soma N% do preço corrente         ±[R$] N   soma N reais
+#   xN / *N  multiplica o preço corrente por N
+# Números aceitam "1234.5", "1234,50", "1.500" (milhar) e "1.234,56"; ambíguos como "1,234.56" são recusados,
+# assim como sinal repetido ("--10", "-R$ -5"). O texto é compilado uma vez (cache por texto)
+# em um Discount, que funciona tanto com float quanto com arrays NumPy.
+
+
+class DiscountError(ValueError):
+    pass
+
+
+_NUM = r"\d[\d.,]*|[.,]\d+"
+_TERM_RE = re.compile(
+    rf"""\s*(?:
+        (?P<mul>[x×*])\s*(?P<fator>{_NUM})
+      | (?P<sinal>[+-])?\s*(?P<moeda>r\$)?\s*(?P<sinal2>[+-])?\s*(?P<valor>{_NUM})\s*(?P<pct>%)?
+    )\s*""",
+    re.VERBOSE | re.IGNORECASE,
+)
+
+
+@dataclass(frozen=True)
+class Discount:
+    # Termos compilados: ("pct", N), ("valor", N) ou ("fator", N)
+    ops: tuple = ()
+
+    def __call__(self, preco):
+        for op, n in self.ops:
+            if op == "pct":
+                preco = preco + preco * (n / 100)
+            elif op == "valor":
+                preco = preco + n
+            else:
+                preco = preco * n
+        return preco
+
+    def __bool__(self):
+        return bool(self.ops)
+
+
+NO_DISCOUNT = Discount()
+
+
+def _number(raw):
+    try:
+        return parse_br_number(raw)
+    except ValueError as e:
+        raise DiscountError(str(e))
+
+
+@lru_cache(maxsize=512)
+def compile_discount(text):
+    """Discount para o texto digitado (vazio ou None: sem ajuste). Levanta DiscountError."""
+    text = (text or "").strip()
+    ops, pos = [], 0
+    while pos < len(text):
+        m = _TERM_RE.match(text, pos)
+        if not m or m.end() == pos:
+            raise DiscountError(f"Desconto inválido perto de '{text[pos:].strip()}' (use -10%, +R$ 500 ou x0.9)")
+        if m.group("mul"):
+            ops.append(("fator", _number(m.group("fator"))))
+        else:
+            if m.group("sinal") and m.group("sinal2"):
+                raise DiscountError(f"Sinal repetido: '{m.group().strip()}'")
+            sinal = -1 if "-" in (m.group("sinal"), m.group("sinal2")) else 1
+            if m.group("pct") and m.group("moeda"):
+                raise DiscountError(f"Use R$ ou %, não os dois: '{m.group().strip()}'")
+            ops.append(("pct" if m.group("pct") else "valor", sinal * _number(m.group("valor"))))
+        pos = m.end()
+    return Discount(tuple(ops)) if ops else NO_DISCOUNT
@@ -1,28 +1,88 @@
 import math
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
+
+import numpy as np
+
+from discount import DiscountError, NO_DISCOUNT, compile_discount
+
+# Simulação de risco (simular_orcamento)
+SIM_TENTATIVAS = 100_000
+SIM_MIN_AMOSTRAS = 3      # tarefas históricas mínimas para usar a dispersão do próprio serviço
+SIM_SIGMA_MIN = 0.02      # abaixo disso a dispersão observada não informa nada (horas copiadas do catálogo)
+SIM_SIGMA_PADRAO = 0.25   # dispersão (em log) quando não há histórico que varie
+
+
+def _sigma_lognormal(cv2):
+    # sigma da lognormal com o coeficiente de variação observado ao quadrado (variância / média²);
+    # None se não há sinal. Só a dispersão relativa é usada: o fator sorteado tem média 1, e a razão
+    # média (que muda com edições do catálogo) não vira estouro
+    sigma = math.sqrt(math.log1p(cv2))
+    return sigma if sigma >= SIM_SIGMA_MIN else None
+
+
+def _simular_horas(horas, sigma, tentativas, semente):
+    # Horas totais de cada tentativa: cada tarefa vezes o seu fator lognormal de média 1
+    # (mu = -sigma²/2). Função de módulo para poder rodar em outro processo
+    rng = np.random.default_rng(semente)
+    fatores = np.exp(sigma * rng.standard_normal((tentativas, len(horas))) - sigma * sigma / 2)
+    return fatores @ horas
 
-class CalculadoraPreco:
-    def __init__(self, db):
-        self.db = db
 
-    def calcular_hora_tecnica(self):
-        cfg = self.db.get_config()
-        custo_mensal = self.db.get_total_custos_operacionais()
+@dataclass(frozen=True)
+class PricingContext:
+    # Fotografia imutável dos valores de precificação: todas as contas de um orçamento usam os mesmos números
+    valor_hora: float      # custo da hora técnica (custos fixos / horas mensais)
+    imposto_pct: float     # fração (0.32 = 32%)
+    lucro_pct: float       # fração
+    horas_mensais: float
+    custos_fixos: float    # soma dos custos operacionais
+    versao: int            # Database.config_version() quando foi montado
+
+    @classmethod
+    def from_db(cls, db):
+        cfg, custos_fixos, versao = db.get_pricing_inputs()
         # cfg: id, custo, horas, imposto, lucro, meta, nome
         horas_mensais = cfg[2] if cfg else 160
-        return custo_mensal / horas_mensais if horas_mensais > 0 else 0
+        return cls(
+            valor_hora=custos_fixos / horas_mensais if horas_mensais > 0 else 0,
+            imposto_pct=(cfg[3] / 100) if cfg else 0,
+            lucro_pct=(cfg[4] / 100) if cfg else 0.3,
+            horas_mensais=horas_mensais,
+            custos_fixos=custos_fixos,
+            versao=versao,
+        )
+
+    def is_stale(self, db):
+        # Só compara números: sem SQL enquanto o cache de configuração de db estiver válido
+        return db.config_version() != self.versao
+
+
+class CalculadoraPreco:
+    def __init__(self, db, contexto=None):
+        self.db = db
+        self.contexto = contexto or PricingContext.from_db(db)
+
+    def get_contexto(self):
+        # Contexto atual, remontado só quando a configuração ou os custos mudaram
+        if self.contexto.is_stale(self.db):
+            self.contexto = PricingContext.from_db(self.db)
+        return self.contexto
+
+    def calcular_hora_tecnica(self, contexto=None):
+        return (contexto or self.get_contexto()).valor_hora
 
     def calcular_dias_uteis(self, horas_totais):
         # 6 horas produtivas por dia
         if horas_totais <= 0: return 0
         return math.ceil(horas_totais / 6)
 
-    def calcular_orcamento(self, horas_totais, custos_extras, discount_str=None):
-        cfg = self.db.get_config()
-        # cfg: id, custo, horas, imposto, lucro, meta, nome
-        imposto_pct = (cfg[3] / 100) if cfg else 0
-        lucro_ideal_pct = (cfg[4] / 100) if cfg else 0.3
-
-        valor_hora = self.calcular_hora_tecnica()
+    def calcular_orcamento(self, horas_totais, custos_extras, discount_str=None, contexto=None):
+        ctx = contexto or self.get_contexto()
+        imposto_pct = ctx.imposto_pct
+        lucro_ideal_pct = ctx.lucro_pct
+        valor_hora = ctx.valor_hora
 
         # 1. Custo Base
         custo_producao = (horas_totais * valor_hora) + custos_extras
@@ -33,31 +93,8 @@ class CalculadoraPreco:
         base_com_imposto = custo_producao + valor_impostos_base
         preco_sugerido = base_com_imposto * (1 + lucro_ideal_pct)
 
-        # 3. Aplicar Desconto/Acréscimo
-        preco_final = preco_sugerido
-
-        if discount_str:
-            discount_str = discount_str.strip()
-            if discount_str:
-                try:
-                    # Tenta limpar string
-                    clean_str = discount_str.lower().replace("r$", "").replace(" ", "").replace(",", ".")
-
-                    val_adjustment = 0.0
-
-                    if "%" in clean_str:
-                        # Porcentagem
-                        pct_val = float(clean_str.replace("%", ""))
-                        # Se digitar "-10%", pct_val é -10.
-                        # Aplicamos sobre o preço sugerido
-                        val_adjustment = preco_sugerido * (pct_val / 100)
-                    else:
-                        # Valor absoluto
-                        val_adjustment = float(clean_str)
-
-                    preco_final = preco_sugerido + val_adjustment
-                except ValueError:
-                    pass # Ignora input inválido
+        # 3. Aplicar Desconto/Acréscimo ("-10%" soma -10% do preço sugerido; texto inválido levanta DiscountError)
+        preco_final = compile_discount(discount_str)(preco_sugerido)
 
         # 4. Calcular Margem Real (Effective Margin)
         # Margem Real = (Preço Final - Custos - Impostos Reais) / Preço Final
@@ -78,24 +115,86 @@ class CalculadoraPreco:
             "dias_uteis": self.calcular_dias_uteis(horas_totais)
         }
 
-    def calcular_ponto_equilibrio(self):
+    def calcular_orcamentos_batch(self, horas, extras, discounts=None, contexto=None, ignorar_invalidos=False):
+        """Versão vetorizada de calcular_orcamento para muitos orçamentos de uma vez.
+
+        horas e extras são sequências do mesmo tamanho (ou escalares); discounts é uma sequência de
+        textos de desconto (ou None). Um desconto inválido levanta DiscountError com a posição, ou é
+        tratado como "sem desconto" com ignorar_invalidos=True (textos antigos gravados). Devolve o
+        mesmo dicionário de calcular_orcamento com arrays NumPy no lugar dos números (valor_hora
+        continua escalar), com as contas feitas na mesma ordem para os valores baterem com o cálculo
+        unitário.
+        """
+        horas, extras = np.broadcast_arrays(np.asarray(horas, dtype=float), np.asarray(extras, dtype=float))
+
+        # Um só contexto para o lote inteiro
+        ctx = contexto or self.get_contexto()
+        imposto_pct = ctx.imposto_pct
+        lucro_ideal_pct = ctx.lucro_pct
+        valor_hora = ctx.valor_hora
+
+        custo_producao = (horas * valor_hora) + extras
+        valor_impostos_base = custo_producao * imposto_pct
+        base_com_imposto = custo_producao + valor_impostos_base
+        preco_sugerido = base_com_imposto * (1 + lucro_ideal_pct)
+
+        # Descontos: orçamentos agrupados pelo texto, cada ajuste compilado aplicado de uma vez ao grupo
+        preco_final = np.array(preco_sugerido, dtype=float)
+        if discounts is not None:
+            discounts = list(discounts)
+            if len(discounts) != horas.size:
+                raise ValueError(f"discounts tem {len(discounts)} itens para {horas.size} orçamentos")
+            grupos = {}
+            for i, texto in enumerate(discounts):
+                grupos.setdefault(texto, []).append(i)
+            final, sugerido = preco_final.reshape(-1), preco_sugerido.reshape(-1)
+            for texto, posicoes in grupos.items():
+                try:
+                    ajuste = compile_discount(texto)
+                except DiscountError as e:
+                    if not ignorar_invalidos:
+                        raise DiscountError(f"Orçamento {posicoes[0]}: {e}")
+                    ajuste = NO_DISCOUNT
+                if ajuste:
+                    posicoes = np.array(posicoes)
+                    final[posicoes] = ajuste(sugerido[posicoes])
+
+        impostos_reais = preco_final * imposto_pct
+        lucro_liquido_real = preco_final - custo_producao - impostos_reais
+        positivo = preco_final > 0
+        margem_real_pct = np.where(positivo, lucro_liquido_real / np.where(positivo, preco_final, 1) * 100, 0.0)
+
+        # Mesmo critério de calcular_dias_uteis (6 horas produtivas por dia)
+        dias_uteis = np.where(horas > 0, np.ceil(horas / 6), 0).astype(int)
+
+        return {
+            "valor_hora": valor_hora,
+            "custo_producao": custo_producao,
+            "preco_sugerido": preco_sugerido,
+            "preco_final": preco_final,
+            "lucro_liquido_real": lucro_liquido_real,
+            "margem_real_pct": margem_real_pct,
+            "impostos_reais": impostos_reais,
+            "dias_uteis": dias_uteis
+        }
+
+    def calcular_ponto_equilibrio(self, contexto=None):
+        ctx = contexto or self.get_contexto()
         # 1. Custos Fixos Totais
-        custos_fixos = self.db.get_total_custos_operacionais()
+        custos_fixos = ctx.custos_fixos
 
         # 2. Preço Médio de Venda da Hora
         # Usamos a eficiência real (média vendida) ou a técnica?
         # Para ser realista ("quanto eu REALMENTE preciso vender"), usamos a média histórica recente.
-        real_rate, tech_cost = self.db.get_hourly_efficiency() # Pega histórico geral ou ano? Padrão é geral.
+        # Só o histórico vem do banco; hora técnica e margem são as do contexto
+        real_rate = self.db.get_sold_hourly_rate() # Pega histórico geral ou ano? Padrão é geral.
 
         if real_rate <= 0:
             # Fallback para hora técnica + margem padrão se não tiver vendas
-            cfg = self.db.get_config()
-            lucro_padrao = (cfg[4]/100) if cfg else 0.3
-            real_rate = tech_cost * (1 + lucro_padrao) # Aproximação
+            real_rate = ctx.valor_hora * (1 + ctx.lucro_pct) # Aproximação
 
         # 3. Imposto Médio
-        cfg = self.db.get_config()
-        imposto_pct = (cfg[3] / 100) if cfg else 0.0
+        imposto_pct = ctx.imposto_pct
 
         # Margem de Contribuição por Hora = Preço - (Preço * Imposto)
         # Assumindo que não há custos variáveis por hora (materiais) além do imposto, já que custos operacionais são fixos.
@@ -108,3 +207,106 @@ class CalculadoraPreco:
         receita_necessaria = horas_necessarias * real_rate
 
         return horas_necessarias, receita_necessaria, real_rate
+
+    def calcular_sensibilidade_equilibrio(self, impostos, lucros, horas_mensais, deltas_custo, contexto=None, preco_hora=None):
+        """Ponto de equilíbrio para todas as combinações dos eixos, numa passada NumPy.
+
+        impostos e lucros em %, horas_mensais em horas e deltas_custo em R$ somados aos custos fixos.
+        A regra é a de calcular_ponto_equilibrio; o preço médio vendido (preco_hora) é lido do banco
+        uma vez só, se não vier. Devolve {"horas", "receita", "preco_hora"} com arrays de forma
+        (impostos, lucros, horas_mensais, deltas_custo); 0 horas onde não há como pagar as contas.
+        """
+        ctx = contexto or self.get_contexto()
+        if preco_hora is None:
+            preco_hora = self.db.get_sold_hourly_rate()
+
+        imposto_pct = np.asarray(impostos, dtype=float).reshape(-1, 1, 1, 1) / 100
+        lucro_pct = np.asarray(lucros, dtype=float).reshape(1, -1, 1, 1) / 100
+        horas = np.asarray(horas_mensais, dtype=float).reshape(1, 1, -1, 1)
+        custos_fixos = ctx.custos_fixos + np.asarray(deltas_custo, dtype=float).reshape(1, 1, 1, -1)
+        forma = np.broadcast_shapes(imposto_pct.shape, lucro_pct.shape, horas.shape, custos_fixos.shape)
+
+        if preco_hora > 0:
+            real_rate = np.full(forma, float(preco_hora))
+        else:
+            # Sem vendas: hora técnica (custos / horas) + margem padrão, como no cálculo unitário
+            tech_cost = np.where(horas > 0, custos_fixos / np.where(horas > 0, horas, 1), 0.0)
+            real_rate = np.broadcast_to(tech_cost * (1 + lucro_pct), forma)
+
+        margem_contrib_hora = real_rate * (1 - imposto_pct)
+        possivel = margem_contrib_hora > 0
+        horas_necessarias = np.where(possivel, custos_fixos / np.where(possivel, margem_contrib_hora, 1), 0.0)
+        receita_necessaria = horas_necessarias * real_rate
+
+        return {"horas": horas_necessarias, "receita": receita_necessaria, "preco_hora": real_rate}
+
+    def _dispersao_tarefas(self, servico_ids):
+        # (sigmas, fontes) por tarefa: a dispersão do próprio serviço se houver histórico que varie, senão
+        # a de todos os serviços juntos, senão SIM_SIGMA_PADRAO. Fonte: "servico", "geral" ou "padrao".
+        # A geral junta só a variação dentro de cada serviço (CV² ponderado pelos graus de liberdade):
+        # serviços com razões médias diferentes não são risco, cada um já é corrigido pela sua média
+        dispersao = self.db.get_service_hour_dispersion()
+        validos = [(n, v / (m * m)) for n, m, v in dispersao.values() if n > 1 and m > 0]
+        graus = sum(n - 1 for n, _ in validos)
+        geral = _sigma_lognormal(sum((n - 1) * cv2 for n, cv2 in validos) / graus) if graus else None
+
+        sigmas, fontes = [], []
+        for sid in servico_ids:
+            n, media, variancia = dispersao.get(sid, (0, 0.0, 0.0))
+            proprio = _sigma_lognormal(variancia / (media * media)) if n >= SIM_MIN_AMOSTRAS and media > 0 else None
+            if proprio is not None:
+                sigma, fonte = proprio, "servico"
+            elif geral is not None:
+                sigma, fonte = geral, "geral"
+            else:
+                sigma, fonte = SIM_SIGMA_PADRAO, "padrao"
+            sigmas.append(sigma)
+            fontes.append(fonte)
+        return np.array(sigmas, dtype=float), fontes
+
+    def simular_orcamento(self, tarefas, custos_extras=0.0, discount_str=None, tentativas=SIM_TENTATIVAS,
+                          processos=None, semente=None, contexto=None):
+        """Monte Carlo do estouro de horas de um orçamento; tarefas = [(horas, servico_id)].
+
+        O preço é o de calcular_orcamento com as horas previstas. Em cada tentativa as horas de cada
+        tarefa são multiplicadas por um fator lognormal de média 1, com a dispersão histórica do
+        serviço (Database.get_service_hour_dispersion), e a margem real é recalculada com esse custo.
+        processos > 1 divide as tentativas entre processos. Devolve o preço, as margens de todas as
+        tentativas, percentis de margem e de horas, a probabilidade de prejuízo e de onde veio a
+        dispersão de cada tarefa (fontes_dispersao).
+        """
+        ctx = contexto or self.get_contexto()
+        horas = np.array([h for h, _ in tarefas], dtype=float)
+        sigma, fontes = self._dispersao_tarefas([sid for _, sid in tarefas])
+        orcamento = self.calcular_orcamento(float(horas.sum()), custos_extras, discount_str, contexto=ctx)
+        preco_final = orcamento["preco_final"]
+
+        # Sementes independentes por bloco: o resultado depende só de (semente, processos)
+        blocos = max(int(processos or 1), 1)
+        sementes = np.random.SeedSequence(semente).spawn(blocos)
+        tamanhos = [len(b) for b in np.array_split(np.arange(tentativas), blocos)]
+        if blocos > 1:
+            with ProcessPoolExecutor(max_workers=blocos) as pool:
+                partes = list(pool.map(_simular_horas, repeat(horas), repeat(sigma), tamanhos, sementes))
+        else:
+            partes = [_simular_horas(horas, sigma, tentativas, sementes[0])]
+        horas_reais = np.concatenate(partes)
+
+        # Mesmas contas de calcular_orcamento, com o custo das horas sorteadas
+        custo_producao = (horas_reais * ctx.valor_hora) + custos_extras
+        impostos_reais = preco_final * ctx.imposto_pct
+        lucro_liquido_real = preco_final - custo_producao - impostos_reais
+        margens = lucro_liquido_real / preco_final * 100 if preco_final > 0 else np.zeros_like(lucro_liquido_real)
+
+        percentis = (5, 25, 50, 75, 95)
+        return {
+            "preco_final": preco_final,
+            "margem_prevista": orcamento["margem_real_pct"],
+            "margens": margens,
+            "margem_media": float(margens.mean()),
+            "margem_percentis": dict(zip(percentis, np.percentile(margens, percentis).tolist())),
+            "horas_percentis": dict(zip(percentis, np.percentile(horas_reais, percentis).tolist())),
+            "prob_prejuizo": float((lucro_liquido_real < 0).mean()),
+            # Tarefas por origem da dispersão: sem "servico" nem "geral" não houve histórico que variasse
+            "fontes_dispersao": {f: fontes.count(f) for f in ("servico", "geral", "padrao") if f in fontes},
+        }
@@ -0,0 +1,184 @@
+import csv
+import datetime
+import json
+import re
+from functools import lru_cache
+
+from search_query import STATUS_VALUES
+from text_utils import fold_text, parse_br_number
+
+# --- Importação de projetos históricos (CSV / NDJSON) ---
+# Os leitores são geradores: devolvem um projeto por vez ({coluna: valor, "tarefas": [...]}),
+# então a memória não cresce com o tamanho do arquivo. normalize_project converte cada um para
+# as colunas/formatos de 'projetos' e é usado por Database.bulk_import_projects.
+#
+# CSV: uma linha por tarefa, com as colunas do projeto repetidas. Linhas seguidas com a mesma
+# coluna "projeto" (ou "id") formam um projeto, então o arquivo deve vir agrupado por ela; sem
+# essa coluna cada linha é um projeto. NDJSON: um objeto JSON por linha, com a lista "tarefas".
+
+# Nome de coluna normalizado (minúsculo, sem acento, "_" no lugar de espaço) -> campo
+COLUMN_ALIASES = {
+    "projeto": "projeto", "id": "projeto", "id_projeto": "projeto",
+    "cliente": "cliente",
+    "data_criacao": "data_criacao", "criado": "data_criacao", "criado_em": "data_criacao", "data": "data_criacao",
+    "data_entrega": "data_entrega", "entrega": "data_entrega",
+    "status": "status",
+    "custo_extras": "custo_extras", "extras": "custo_extras",
+    "preco_final": "preco_final", "preco": "preco_final", "valor": "preco_final",
+    "categoria": "categoria",
+    "desconto_texto": "desconto_texto", "desconto": "desconto_texto",
+    "data_atualizacao": "data_atualizacao", "atualizado": "data_atualizacao", "atualizado_em": "data_atualizacao",
+    "tarefa": "descricao", "descricao": "descricao", "servico": "descricao",
+    "horas": "horas", "horas_estimadas": "horas",
+}
+TASK_FIELDS = ("descricao", "horas")
+
+# AAAA-MM-DD ou DD/MM/AAAA (ano com 2 ou 4 dígitos), com hora opcional (" " ou "T")
+_ISO_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?")
+_BR_DATE_RE = re.compile(r"(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})(?: (\d{1,2}):(\d{2})(?::(\d{2}))?)?")
+
+
+def _fold(text):
+    # Minúsculo e sem acentos (mesma normalização da busca), para comparar nomes digitados à mão
+    return fold_text(str(text).strip())
+
+
+@lru_cache(maxsize=None)
+def _column_key(name):
+    return COLUMN_ALIASES.get(re.sub(r"[\s\-]+", "_", _fold(name)))
+
+
+def _canonical(record):
+    # Renomeia as chaves conhecidas; o resto é descartado
+    out = {}
+    for name, value in record.items():
+        key = _column_key(name) if name is not None else None
+        if key and key not in out:
+            out[key] = value
+    return out
+
+
+def read_projects_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        # Cabeçalho resolvido uma vez: [(índice, campo)] das colunas reconhecidas
+        header = next(reader, [])
+        colunas = [(i, _column_key(name)) for i, name in enumerate(header) if _column_key(name)]
+        atual, chave_atual = None, None
+        for values in reader:
+            row = {campo: values[i] for i, campo in colunas if i < len(values)}
+            chave = row.get("projeto")
+            if atual is None or not chave or chave != chave_atual:
+                if atual is not None:
+                    yield atual
+                atual = {k: v for k, v in row.items() if k not in TASK_FIELDS}
+                atual["tarefas"] = []
+                chave_atual = chave
+            if row.get("descricao"):
+                atual["tarefas"].append({"descricao": row["descricao"], "horas": row.get("horas")})
+        if atual is not None:
+            yield atual
+
+
+def read_projects_ndjson(path):
+    with open(path, encoding="utf-8-sig") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Linha {n}: JSON inválido ({e.msg})")
+            projeto = _canonical(obj)
+            projeto["tarefas"] = [_canonical(t) for t in obj.get("tarefas") or []]
+            yield projeto
+
+
+def read_projects(path):
+    if path.lower().endswith((".ndjson", ".jsonl", ".json")):
+        return read_projects_ndjson(path)
+    return read_projects_csv(path)
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_text(value):
+    m = _ISO_DATE_RE.fullmatch(value)
+    if m:
+        ano, mes, dia = m.group(1), m.group(2), m.group(3)
+    else:
+        m = _BR_DATE_RE.fullmatch(value)
+        if not m:
+            raise ValueError(f"Data inválida: '{value}'")
+        dia, mes, ano = m.group(1), m.group(2), m.group(3)
+        if len(ano) == 2:
+            ano = "20" + ano
+    try:
+        return datetime.datetime(int(ano), int(mes), int(dia), *(int(g or 0) for g in m.groups()[3:]))
+    except ValueError:
+        raise ValueError(f"Data inválida: '{value}'")
+
+
+def parse_date(value):
+    # Datas históricas se repetem muito: o cache evita reinterpretar o mesmo texto
+    value = str(value or "").strip()
+    return _parse_date_text(value) if value else None
+
+
+def parse_number(value):
+    # Aceita 1234.5, "1234,50", "R$ 1.234,56" e "1.500" (milhar); o que for ambíguo é erro da linha
+    if value is None or isinstance(value, (int, float)):
+        return float(value or 0)
+    text = str(value).replace("R$", "").replace(" ", "").strip()
+    if not text:
+        return 0.0
+    try:
+        return parse_br_number(text)
+    except ValueError:
+        raise ValueError(f"Valor inválido: '{value}'")
+
+
+@lru_cache(maxsize=256)
+def _status(value):
+    for status in STATUS_VALUES:
+        if _fold(status) == _fold(value or ""):
+            return status
+    return str(value).strip() if value else "Orçamento"
+
+
+def normalize_project(raw):
+    """Converte um projeto lido do arquivo para ((colunas de 'projetos'), [(descricao, horas)]).
+
+    Os valores saem como a UI os entrega a Database: criação AAAA-MM-DD, entrega date (ou None),
+    atualização datetime e dinheiro em float; bulk_import_projects os passa para o formato gravado.
+    Levanta ValueError se o projeto não puder ser importado.
+    """
+    cliente = str(raw.get("cliente") or "").strip()
+    if not cliente:
+        raise ValueError("Projeto sem cliente")
+
+    criado = parse_date(raw.get("data_criacao"))
+    atualizado = parse_date(raw.get("data_atualizacao"))
+    criado = criado or atualizado
+    if criado is None:
+        raise ValueError(f"Projeto de '{cliente}' sem data")
+    atualizado = atualizado or criado
+    entrega = parse_date(raw.get("data_entrega"))
+
+    tarefas = []
+    for t in raw.get("tarefas") or []:
+        descricao = str(t.get("descricao") or "").strip()
+        if descricao:
+            tarefas.append((descricao, parse_number(t.get("horas"))))
+
+    projeto = (
+        cliente,
+        criado.strftime("%Y-%m-%d"),
+        entrega.date() if entrega else None,
+        _status(raw.get("status")),
+        parse_number(raw.get("custo_extras")),
+        parse_number(raw.get("preco_final")),
+        str(raw.get("categoria") or "").strip() or "Geral",
+        atualizado,
+        str(raw.get("desconto_texto") or "").strip(),
+    )
+    return projeto, tarefas
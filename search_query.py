@@ -0,0 +1,325 @@
+import datetime
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+from text_utils import fold_text, parse_br_number
+
+# --- Linguagem de busca de "Meus Projetos" ---
+# Exemplo: status:Aprovado cat:Residencial preco:>5000 criado:2025-01..2025-06 entrega:<30d
+#
+# O texto vira uma AST (tupla de termos) e depois um SearchPlan: JOIN com o FTS + cláusulas WHERE
+# parametrizadas sobre colunas indexadas. Os planos ficam em cache por (texto, fts_enabled).
+#
+# Valores aceitos:
+#   campo:valor, campo:a,b (lista), campo:>=v / >v / <v / <=v / =v, campo:a..b (intervalo, pontas opcionais)
+#   datas: AAAA, AAAA-MM, AAAA-MM-DD ou DD/MM/AAAA (períodos inteiros) e Nd (N dias de hoje:
+#   idade para criado/atualizado, prazo para entrega). "-campo:valor" nega o filtro.
+# Palavras soltas continuam sendo busca de texto, e ">5000" solto continua filtrando o preço.
+
+
+class SearchQueryError(ValueError):
+    pass
+
+
+STATUS_VALUES = ("Orçamento", "Aprovado", "Em Execução", "Concluído")
+
+# campo -> (tipo, expressão SQL). Tipos no formato gravado (database.py): "centavos" compara
+# o número digitado (em reais) com a coluna em centavos e "instante" compara datas com a coluna
+# em segundos desde a época; "data" é AAAA-MM-DD.
+FIELDS = {
+    "id": ("numero", "p.id"),
+    "status": ("status", "p.status"),
+    "cat": ("texto", "p.categoria"),
+    "cliente": ("cliente", "p.cliente"),
+    "preco": ("centavos", "p.preco_final"),
+    "horas": ("numero", "p.horas_totais"),
+    "criado": ("data", "p.data_criacao"),
+    "atualizado": ("instante", "p.data_atualizacao"),
+    "entrega": ("data", "p.data_entrega"),
+}
+DATE_KINDS = ("data", "instante")
+FIELD_ALIASES = {"categoria": "cat", "valor": "preco", "criacao": "criado", "atualizacao": "atualizado"}
+# Em campos no passado "<30d" é idade: a comparação com a data se inverte
+PAST_FIELDS = ("criado", "atualizado")
+# Limites do que se digita: centavos cabem no INTEGER do SQLite e "Nd" não sai do calendário
+MAX_NUMERO = 1e15
+MAX_DIAS = 36500
+
+
+@dataclass(frozen=True)
+class TextTerm:
+    text: str
+
+
+@dataclass(frozen=True)
+class FieldTerm:
+    field: str
+    op: str       # "=", "<", "<=", ">", ">=", "in" ou "range"
+    values: tuple # 1 valor; a lista de "in"; (inicio, fim) de "range", com None na ponta aberta
+    negate: bool = False
+
+
+@dataclass(frozen=True)
+class DaysFromToday:
+    # Data relativa, resolvida só na execução: o plano em cache não envelhece
+    days: int
+
+    def resolve(self, today):
+        return (today + datetime.timedelta(days=self.days)).isoformat()
+
+
+@dataclass(frozen=True)
+class LocalMidnight:
+    # Começo do dia (hora local) em segundos desde a época, para colunas "instante"
+    date: object  # AAAA-MM-DD ou DaysFromToday
+
+    def resolve(self, today):
+        date = self.date.resolve(today) if isinstance(self.date, DaysFromToday) else self.date
+        return int(datetime.datetime.fromisoformat(date).timestamp())
+
+
+@dataclass(frozen=True)
+class SearchPlan:
+    joins: str
+    where: tuple
+    params: tuple
+    has_rank: bool = False
+
+    def bind(self, today=None):
+        today = today or datetime.date.today()
+        return [p.resolve(today) if isinstance(p, (DaysFromToday, LocalMidnight)) else p for p in self.params]
+
+
+_OPERATORS = (">=", "<=", ">", "<", "=")
+_TOKEN_RE = re.compile(r'(-?)(\w+):((?:"[^"]*"|[^\s"])*)|"([^"]*)"|(\S+)')
+_DATE_RE = re.compile(r"(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?$|(\d{1,2})/(\d{1,2})/(\d{4})$")
+
+
+def fts_match_query(text):
+    # Texto livre -> expressão MATCH do FTS5: cada palavra vira um prefixo ("pal"*), todas obrigatórias
+    tokens = re.findall(r"\w+", text)
+    return " AND ".join('"' + tok.replace('"', '""') + '"*' for tok in tokens)
+
+
+def _split_op(value):
+    for op in _OPERATORS:
+        if value.startswith(op):
+            return op, value[len(op):]
+    return "=", value
+
+
+def _parse_number(raw):
+    # Formato brasileiro ("5.000", "1.234,56"); inf/nan/1e400 e valores fora de MAX_NUMERO são erro
+    try:
+        valor = parse_br_number(raw)
+    except ValueError:
+        raise SearchQueryError(f"Número inválido: '{raw}'")
+    if abs(valor) >= MAX_NUMERO:
+        raise SearchQueryError(f"Número fora do limite: '{raw}'")
+    return valor
+
+
+def _parse_date(raw, field):
+    # Período [inicio, fim) coberto por um literal de data
+    if re.fullmatch(r"\d+d", raw):
+        dias = int(raw[:-1])
+        if dias > MAX_DIAS:
+            raise SearchQueryError(f"Data relativa muito longe: '{raw}' (até {MAX_DIAS}d)")
+        if field in PAST_FIELDS:
+            return DaysFromToday(-dias), DaysFromToday(-dias + 1)
+        return DaysFromToday(dias), DaysFromToday(dias + 1)
+
+    m = _DATE_RE.match(raw)
+    if not m:
+        raise SearchQueryError(f"Data inválida: '{raw}' (use AAAA-MM-DD, DD/MM/AAAA ou 30d)")
+    try:
+        if m.group(6):
+            inicio = datetime.date(int(m.group(6)), int(m.group(5)), int(m.group(4)))
+            return inicio.isoformat(), (inicio + datetime.timedelta(days=1)).isoformat()
+        ano, mes, dia = int(m.group(1)), m.group(2), m.group(3)
+        if dia:
+            inicio = datetime.date(ano, int(mes), int(dia))
+            fim = inicio + datetime.timedelta(days=1)
+        elif mes:
+            inicio = datetime.date(ano, int(mes), 1)
+            fim = datetime.date(ano + int(mes) // 12, int(mes) % 12 + 1, 1)
+        else:
+            inicio, fim = datetime.date(ano, 1, 1), datetime.date(ano + 1, 1, 1)
+    except ValueError:
+        raise SearchQueryError(f"Data inválida: '{raw}'")
+    return inicio.isoformat(), fim.isoformat()
+
+
+def _parse_status(raw):
+    # Aceita sem acento e por prefixo de palavra ("execucao", "concl"); se for ambíguo, usa o texto como veio
+    norm = fold_text(raw)
+    hits = [s for s in STATUS_VALUES if any(w.startswith(norm) for w in fold_text(s).split())]
+    return hits[0] if len(hits) == 1 else raw
+
+
+def _parse_value(field, raw):
+    kind = FIELDS[field][0]
+    if kind == "numero":
+        return _parse_number(raw)
+    if kind == "centavos":
+        return round(_parse_number(raw) * 100)
+    if kind in DATE_KINDS:
+        return _parse_date(raw, field)
+    if kind == "status":
+        return _parse_status(raw)
+    return raw
+
+
+def _parse_field(field, raw, negate):
+    op, raw = _split_op(raw)
+    if not raw:
+        return None  # Ainda digitando ("preco:>")
+
+    if ".." in raw and op == "=":
+        lo, hi = raw.split("..", 1)
+        values = (_parse_value(field, lo) if lo else None, _parse_value(field, hi) if hi else None)
+        return FieldTerm(field, "range", values, negate)
+
+    if op == "=":
+        parts = [a or b for a, b in re.findall(r'"([^"]*)"|([^,"]+)', raw)]
+        values = tuple(_parse_value(field, v) for v in parts if v)
+        if not values:
+            return None
+        if len(values) > 1:
+            return FieldTerm(field, "in", values, negate)
+        return FieldTerm(field, "=", values, negate)
+
+    return FieldTerm(field, op, (_parse_value(field, raw),), negate)
+
+
+def parse_query(text):
+    """Converte o texto da busca numa tupla de TextTerm/FieldTerm."""
+    # "> 5000" e "preco: > 5000" valem o mesmo que ">5000"
+    text = re.sub(r"(^|\s|:)(>=|<=|>|<|=)\s+", r"\1\2", text.strip())
+
+    terms = []
+    for m in _TOKEN_RE.finditer(text):
+        negate, name, raw, quoted, bare = m.groups()
+        field = FIELD_ALIASES.get(name.lower(), name.lower()) if name else None
+
+        if field in FIELDS:
+            term = _parse_field(field, raw, bool(negate))
+        elif bare and bare.startswith(_OPERATORS) and re.fullmatch(r"(>=|<=|>|<|=)\d+([.,]\d+)?", bare):
+            term = _parse_field("preco", bare, False)
+        else:
+            term = TextTerm(quoted if quoted is not None else m.group(0))
+        if term:
+            terms.append(term)
+    return tuple(terms)
+
+
+def _compile_field(term):
+    kind, col = FIELDS[term.field]
+    if kind == "cliente":
+        # Sem FTS (ou negado): substring como na busca antiga
+        if term.op not in ("=", "in"):
+            raise SearchQueryError("cliente: aceita apenas texto")
+        sql = "(" + " OR ".join(f"{col} LIKE ?" for _ in term.values) + ")"
+        params = [f"%{v}%" for v in term.values]
+    elif term.op == "in":
+        if kind in DATE_KINDS:
+            sql = "(" + " OR ".join(f"({col} >= ? AND {col} < ?)" for _ in term.values) + ")"
+            params = [b for v in term.values for b in v]
+        else:
+            sql, params = f"{col} IN ({', '.join('?' * len(term.values))})", list(term.values)
+    elif kind in DATE_KINDS:
+        sql, params = _compile_date(term, col)
+    elif term.op == "range":
+        lo, hi = term.values
+        conds = ([f"{col} >= ?"] if lo is not None else []) + ([f"{col} <= ?"] if hi is not None else [])
+        sql, params = " AND ".join(conds) or f"{col} IS NOT NULL", [v for v in (lo, hi) if v is not None]
+    else:
+        sql, params = f"{col} {term.op} ?", [term.values[0]]
+
+    if kind == "instante":
+        params = [LocalMidnight(p) for p in params]
+        try:
+            # Datas que a plataforma não converte para segundos desde a época falham aqui, não na execução
+            for p in params:
+                p.resolve(datetime.date.today())
+        except (OverflowError, OSError, ValueError):
+            raise SearchQueryError(f"Data fora do intervalo em '{term.field}'")
+    if term.negate:
+        # NULL conta como "não casa" e entra no resultado negado
+        sql = f"NOT IFNULL(({sql}), 0)"
+    return sql, params
+
+
+def _compile_date(term, col):
+    # Datas viram intervalos meio-abertos [inicio, fim) comparados direto na coluna indexada
+    if term.op == "range":
+        lo, hi = term.values
+        relativos = [v for v in (lo, hi) if v is not None]
+        if term.field in PAST_FIELDS and relativos and all(isinstance(v[0], DaysFromToday) for v in relativos):
+            lo, hi = hi, lo  # "criado:7d..30d": 30 dias atrás vem antes de 7 dias atrás
+        conds, params = [], []
+        if lo is not None:
+            conds.append(f"{col} >= ?")
+            params.append(lo[0])
+        if hi is not None:
+            conds.append(f"{col} < ?")
+            params.append(hi[1])
+        return " AND ".join(conds) or f"{col} IS NOT NULL", params
+
+    inicio, fim = term.values[0]
+    op = term.op
+    if term.field in PAST_FIELDS and isinstance(inicio, DaysFromToday):
+        op = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}.get(op, op)
+
+    if op == "=":
+        return f"{col} >= ? AND {col} < ?", [inicio, fim]
+    if op == "<":
+        return f"{col} < ?", [inicio]
+    if op == "<=":
+        return f"{col} < ?", [fim]
+    if op == ">":
+        return f"{col} >= ?", [fim]
+    return f"{col} >= ?", [inicio]
+
+
+@lru_cache(maxsize=256)
+def compile_search(text, fts_enabled=True):
+    """Plano (JOIN, WHERE, parâmetros) para o texto da busca. Levanta SearchQueryError."""
+    terms = parse_query(text)
+    where, params = [], []
+    fts_parts = []
+
+    for term in terms:
+        if isinstance(term, FieldTerm):
+            if term.field == "cliente" and fts_enabled and not term.negate and term.op in ("=", "in"):
+                alts = [fts_match_query(v) for v in term.values]
+                alts = [a for a in alts if a]
+                if alts:
+                    fts_parts.append("cliente : (" + " OR ".join(f"({a})" for a in alts) + ")")
+                    continue
+            sql, term_params = _compile_field(term)
+            where.append(sql)
+            params.extend(term_params)
+
+    free_text = " ".join(t.text for t in terms if isinstance(t, TextTerm))
+    joins, join_params, has_rank = "", [], False
+    text_match = fts_match_query(free_text) if fts_enabled else ""
+    if free_text and not text_match:
+        # Fallback to LIKE (no FTS5, or no searchable words)
+        where.append("(p.cliente LIKE ? OR p.categoria LIKE ? OR CAST(p.id AS TEXT) LIKE ?)")
+        params.extend([f"%{free_text}%"] * 3)
+    if text_match:
+        fts_parts.append(text_match)
+
+    if fts_parts:
+        # Resultados do FTS (com relevância) + o próprio ID, se o texto for um número
+        sub = "SELECT rowid AS fts_id, rank AS fts_rank FROM projetos_fts WHERE projetos_fts MATCH ?"
+        join_params.append(" AND ".join(fts_parts))
+        if free_text.isdigit() and len(fts_parts) == 1:
+            sub = f"SELECT fts_id, MIN(fts_rank) AS fts_rank FROM ({sub} UNION ALL SELECT ?, -1e300) GROUP BY fts_id"
+            join_params.append(int(free_text))
+        joins = f" JOIN ({sub}) f ON f.fts_id = p.id"
+        has_rank = True
+
+    return SearchPlan(joins, tuple(where), tuple(join_params + params), has_rank)
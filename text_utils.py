@@ -0,0 +1,41 @@
+import math
+import re
+import unicodedata
+
+# --- Texto digitado à mão: comparação sem acento e números no formato brasileiro ---
+# Usado pela busca (search_query), pela importação de projetos e pelos descontos do orçamento,
+# para que "1.500" ou "Execução" signifiquem a mesma coisa em todos eles.
+
+# Ponto como separador de milhar: "1.500", "12.000.000" (não "0.500", que é decimal)
+_THOUSANDS_RE = re.compile(r"[1-9]\d{0,2}(?:\.\d{3})+")
+# Vírgula decimal, com ou sem milhar: "1.234,56", "1234,5", ",5"
+_BR_DECIMAL_RE = re.compile(r"(?:\d{1,3}(?:\.\d{3})+|\d*),\d+|\d+,")
+# Ponto decimal: "1234.56", "1.5", ".5"
+_DOT_DECIMAL_RE = re.compile(r"\d+(?:\.\d*)?|\.\d+")
+
+
+def fold_text(text):
+    # Minúsculo e sem acentos
+    return "".join(c for c in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(c))
+
+
+def parse_br_number(raw):
+    """Número digitado ('1500', '1.500', '1.234,56', '1234.56', '-10') -> float finito.
+
+    Ponto seguido de grupos de três dígitos é milhar; fora isso vale como decimal. Levanta
+    ValueError para o que não for número ou for ambíguo ('1,234.56', '1.2.3', '1e3', 'nan').
+    """
+    text = raw.strip()
+    sinal = -1.0 if text[:1] == "-" else 1.0
+    if text[:1] in "+-":
+        text = text[1:]
+    if _THOUSANDS_RE.fullmatch(text):
+        text = text.replace(".", "")
+    elif _BR_DECIMAL_RE.fullmatch(text):
+        text = text.replace(".", "").replace(",", ".")
+    elif not _DOT_DECIMAL_RE.fullmatch(text):
+        raise ValueError(f"Número inválido: '{raw}'")
+    valor = float(text)
+    if not math.isfinite(valor):
+        raise ValueError(f"Número fora do limite: '{raw}'")
+    return sinal * valor
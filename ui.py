@@ -7,15 +7,21 @@ from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 
 import matplotlib.pyplot as plt
+import numpy as np
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from tkcalendar import DateEntry
 import json
 import os
 import csv
 import shutil
+import queue
+import threading
 
 from database import Database
-from logic import CalculadoraPreco
+from logic import CalculadoraPreco, SIM_SIGMA_PADRAO
+from project_import import read_projects
+from search_query import SearchQueryError
+from discount import DiscountError
 
 # --- INTERFACE GRÁFICA (GUI) ---
 
@@ -23,6 +29,9 @@ ctk.set_appearance_mode("System")
 ctk.set_default_color_theme("blue")
 
 class App(ctk.CTk):
+    PAGE_SIZE = 50 # Projetos carregados por vez em "Meus Projetos"
+    DISCOUNT_HINT = "Desconto/Taxa (-10% ou +500):"
+
     def __init__(self):
         super().__init__()
         self.title("Protótipo de Gestão de Projetos - Por Victor")
@@ -51,6 +60,9 @@ class App(ctk.CTk):
         self.editing_project_id = None # Control flag for Edit Mode
         self.view_mode = "Lista" # Lista or Kanban
         self.selected_project_ids = []
+        self.select_all_matching = False # Batch bar "select all": every project matching the search
+        self.loaded_projects, self.projects_cursor = [], None
+        self.projects_query, self.projects_sort, self.filtered_count = "", None, 0
 
         # Estilo Treeview (Dark Mode Compat)
         style = ttk.Style()
@@ -182,58 +194,37 @@ class App(ctk.CTk):
         hour = now.hour
         greeting = "Bom dia" if 5 <= hour < 12 else "Boa tarde" if 12 <= hour < 18 else "Boa noite"
 
-        cfg = self.db.get_config()
-        user_name = cfg[6] if len(cfg) > 6 else "Usuário"
-        meta_mensal = cfg[5] if len(cfg) > 5 else 10000.0
-
-        self.lbl_greeting.configure(text=f"{greeting}, {user_name}! Vamos bater a meta hoje?")
-
-        # --- 2. Filter Logic ---
+        # --- 2. Snapshot (uma consulta agregada para todo o painel) ---
         filtro = self.combo_filter.get()
-        f_mes, f_ano, f_dia = None, None, None
-
-        if filtro == "Este Mês":
-            f_mes = now.strftime("%m")
-            f_ano = now.strftime("%Y")
-        elif filtro == "Este Ano":
-            f_ano = now.strftime("%Y")
-        elif filtro == "Hoje":
-             f_dia = now.strftime("%d")
-             f_mes = now.strftime("%m")
-             f_ano = now.strftime("%Y")
+        snap = self.db.get_dashboard_snapshot(filtro)
 
-        # --- 3. KPIs & Metrics ---
-        metrics = self.db.get_dashboard_metrics(filtro_mes=f_mes, filtro_ano=f_ano, filtro_dia=f_dia)
-        total, converted = self.db.get_conversion_rate(filtro_mes=f_mes, filtro_ano=f_ano, filtro_dia=f_dia)
-        real_rate, tech_cost = self.db.get_hourly_efficiency(filtro_mes=f_mes, filtro_ano=f_ano, filtro_dia=f_dia)
+        self.lbl_greeting.configure(text=f"{greeting}, {snap.nome_usuario}! Vamos bater a meta hoje?")
 
+        # --- 3. KPIs & Metrics ---
         # Clear KPIs
         for w in self.metrics_frame.winfo_children(): w.destroy()
 
         # Row 1 of KPIs
-        self.create_metric_card(self.metrics_frame, "Faturamento", f"R$ {metrics['total_orcado']:.2f}", self.col_accent, 0, icon="💰")
+        self.create_metric_card(self.metrics_frame, "Faturamento", f"R$ {snap.total_orcado:.2f}", self.col_accent, 0, icon="💰")
 
-        conv_pct = (converted / total * 100) if total > 0 else 0
-        self.create_metric_card(self.metrics_frame, "Conversão", f"{converted}/{total} ({int(conv_pct)}%)", self.col_success, 1, icon="🤝")
+        self.create_metric_card(self.metrics_frame, "Conversão", f"{snap.total_convertidos}/{snap.total_projetos} ({int(snap.conversao_pct)}%)", self.col_success, 1, icon="🤝")
 
-        self.create_metric_card(self.metrics_frame, "Ticket Médio", f"R$ {metrics['ticket_medio']:.2f}", "#F59E0B", 2, icon="📈")
+        self.create_metric_card(self.metrics_frame, "Ticket Médio", f"R$ {snap.ticket_medio:.2f}", "#F59E0B", 2, icon="📈")
 
         # Row 2 (Efficiency) - Full width or separate
         card_eff = ctk.CTkFrame(self.metrics_frame, fg_color=self.col_card, corner_radius=15)
         card_eff.grid(row=1, column=0, columnspan=3, padx=10, pady=10, sticky="ew")
 
         ctk.CTkLabel(card_eff, text="Eficiência Financeira", font=self.font_label, text_color=self.col_text_muted).pack(anchor="w", padx=15, pady=(10,0))
-        lbl_eff = ctk.CTkLabel(card_eff, text=f"Sua hora técnica custa R$ {tech_cost:.2f}, mas você vendeu a R$ {real_rate:.2f}/h",
+        lbl_eff = ctk.CTkLabel(card_eff, text=f"Sua hora técnica custa R$ {snap.custo_hora_tecnica:.2f}, mas você vendeu a R$ {snap.valor_hora_real:.2f}/h",
                                font=ctk.CTkFont(size=16, weight="bold"), text_color="white")
         lbl_eff.pack(anchor="w", padx=15, pady=(5, 15))
 
         # --- 4. Gamification (Meta) ---
         # Always Monthly Goal
-        metrics_month = self.db.get_dashboard_metrics(filtro_mes=now.strftime("%m"), filtro_ano=now.strftime("%Y"))
-        val_month = metrics_month['total_orcado']
-
-        pct_meta = val_month / meta_mensal if meta_mensal > 0 else 0
-        if pct_meta > 1: pct_meta = 1
+        val_month = snap.faturamento_mes
+        meta_mensal = snap.meta_mensal
+        pct_meta = snap.progresso_meta
 
         self.progress_meta.set(pct_meta)
         self.lbl_meta_val.configure(text=f"R$ {val_month:.2f} / R$ {meta_mensal:.2f} ({int(pct_meta*100)}%)")
@@ -290,7 +281,7 @@ class App(ctk.CTk):
         canvas_line.get_tk_widget().grid(row=0, column=0, padx=5, pady=5, sticky="nsew")
 
         # 6.2 Pie Chart (Origin)
-        cat_data = self.db.get_revenue_by_category(filtro_mes=f_mes, filtro_ano=f_ano, filtro_dia=f_dia)
+        cat_data = snap.receita_por_categoria
 
         fig_pie, ax_pie = plt.subplots(figsize=(4, 3), dpi=100)
         fig_pie.patch.set_facecolor(self.col_card)
@@ -370,14 +361,14 @@ class App(ctk.CTk):
         frame_header.pack(fill="x", padx=10, pady=(10, 5))
 
         # Search
-        self.entry_search = ctk.CTkEntry(frame_header, placeholder_text="🔍 Pesquisar (Cliente ou > 1000)",
+        self.entry_search = ctk.CTkEntry(frame_header, placeholder_text="🔍 Pesquisar (cliente, > 1000, status:Aprovado cat:Residencial criado:2025-01..2025-06 entrega:<30d)",
                                          height=35, border_width=0, fg_color=self.col_card)
         self.entry_search.pack(side="left", fill="x", expand=True, padx=(0, 10))
         self.entry_search.bind("<KeyRelease>", lambda e: self.refresh_projetos())
 
         # Sort
         self.combo_sort = ctk.CTkComboBox(frame_header, width=150,
-                                          values=["Recente", "Antigo", "Maior Valor", "Menor Valor"],
+                                          values=["Recente", "Antigo", "Maior Valor", "Menor Valor", "Relevância"],
                                           command=lambda x: self.refresh_projetos())
         self.combo_sort.set("Recente")
         self.combo_sort.pack(side="left", padx=(0, 10))
@@ -392,6 +383,10 @@ class App(ctk.CTk):
         ctk.CTkButton(frame_header, text="📄 CSV", width=60, command=self.exportar_projetos_csv,
                       fg_color=self.col_card, hover_color=self.col_bg).pack(side="left")
 
+        # Import historical projects (CSV/NDJSON)
+        ctk.CTkButton(frame_header, text="📥 Importar", width=80, command=self.importar_projetos,
+                      fg_color=self.col_card, hover_color=self.col_bg).pack(side="left", padx=(10, 0))
+
         # --- BATCH ACTIONS (Hidden by default) ---
         self.frame_batch = ctk.CTkFrame(self.tab_projetos, fg_color=self.col_accent, height=40, corner_radius=5)
         # We don't pack it yet. We pack it when items selected.
@@ -402,6 +397,16 @@ class App(ctk.CTk):
         ctk.CTkButton(self.frame_batch, text="🗑️ Excluir Selecionados", fg_color="white", text_color="red",
                       hover_color="#fca5a5", command=self.batch_delete).pack(side="right", padx=10, pady=5)
 
+        ctk.CTkButton(self.frame_batch, text="🐑 Duplicar Selecionados", fg_color="white", text_color=self.col_accent,
+                      hover_color="#e2e8f0", command=self.batch_duplicate).pack(side="right", padx=(10, 0), pady=5)
+
+        ctk.CTkButton(self.frame_batch, text="🔄 Alterar Status", fg_color="white", text_color=self.col_accent,
+                      hover_color="#e2e8f0", command=self.batch_status).pack(side="right", padx=(10, 0), pady=5)
+
+        # Extends the selection beyond the loaded pages (shown only when there is more to select)
+        self.btn_select_all = ctk.CTkButton(self.frame_batch, text="Selecionar todos", fg_color="transparent",
+                                            border_width=1, border_color="white", command=self.select_all_projects)
+
         # --- CONTENT AREA ---
         self.scroll_projects = ctk.CTkScrollableFrame(self.tab_projetos, fg_color="transparent")
         self.scroll_projects.pack(fill="both", expand=True, padx=10, pady=5)
@@ -421,7 +426,11 @@ class App(ctk.CTk):
         # Export current view
         query = self.entry_search.get()
         sort_by = self.combo_sort.get()
-        projects = self.db.search_projects(query, sort_by)
+        try:
+            projects = self.db.search_projects(query, sort_by)
+        except SearchQueryError as e:
+            messagebox.showerror("Erro", f"Filtro inválido: {e}")
+            return
 
         filename = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV Files", "*.csv")])
         if not filename: return
@@ -430,25 +439,51 @@ class App(ctk.CTk):
             with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
                 writer = csv.writer(csvfile)
                 writer.writerow(["ID", "Cliente", "Data Entrega", "Status", "Preço Final", "Atualizado em", "Categoria"])
-                for p in projects:
-                    writer.writerow(p)
+                # Same text the CSV always had: dd/mm/yyyy delivery date, "yyyy-mm-dd hh:mm:ss" update time
+                for pid, cliente, entrega, status, preco, atualizado, categoria in projects:
+                    writer.writerow([pid, cliente, entrega.strftime('%d/%m/%Y') if entrega else "", status, preco,
+                                     atualizado.strftime('%Y-%m-%d %H:%M:%S') if atualizado else "", categoria])
             messagebox.showinfo("Sucesso", f"{len(projects)} projetos exportados!")
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao exportar: {e}")
 
     def batch_delete(self):
-        count = len(self.selected_project_ids)
+        count = self.filtered_count if self.select_all_matching else len(self.selected_project_ids)
         if count == 0: return
 
         if messagebox.askyesno("Confirmar Exclusão em Massa", f"Tem certeza que deseja excluir {count} projetos?"):
-            for pid in self.selected_project_ids:
-                self.db.cursor.execute("DELETE FROM tarefas_projeto WHERE projeto_id=?", (pid,))
-                self.db.cursor.execute("DELETE FROM projetos WHERE id=?", (pid,))
-            self.db.conn.commit()
+            # One DELETE per chunk of ids (or one for the whole search); tasks go via ON DELETE CASCADE
+            if self.select_all_matching:
+                # An empty search means every project; the dialog above is the explicit confirmation
+                count = self.db.delete_matching_projects(self.projects_query, todos=not self.projects_query.strip())
+            else:
+                count = self.db.delete_projects(self.selected_project_ids)
 
             self.selected_project_ids = []
             self.refresh_projetos()
-            messagebox.showinfo("Sucesso", "Projetos excluídos!")
+            self.update_dashboard()
+            messagebox.showinfo("Sucesso", f"{count} projetos excluídos!")
+
+    def batch_target_ids(self):
+        # Ids the batch bar acts on: the checked rows, or the whole search in "select all" mode
+        if self.select_all_matching:
+            return [p[0] for p in self.db.search_projects(self.projects_query)]
+        return list(self.selected_project_ids)
+
+    def batch_status(self):
+        ids = self.batch_target_ids()
+        if ids:
+            self.alterar_status(ids, None)
+
+    def batch_duplicate(self):
+        ids = self.batch_target_ids()
+        if not ids: return
+
+        # Single INSERT ... SELECT for the projects and another for their tasks
+        novos = self.db.duplicate_projects(ids)
+        self.refresh_projetos()
+        self.update_dashboard()
+        messagebox.showinfo("Sucesso", f"{len(novos)} projetos duplicados!")
 
     # --- ABA 2: NOVO ORÇAMENTO ---
     def create_tab_novo_orcamento(self):
@@ -527,10 +562,11 @@ class App(ctk.CTk):
         self.entry_extras.bind("<KeyRelease>", self.update_live_preview)
 
         # Desconto
-        lbl_desc = ctk.CTkLabel(f_costs, text="Desconto/Taxa (-10% ou +500):", font=self.font_label)
-        lbl_desc.grid(row=0, column=1, sticky="w", padx=5)
+        self.lbl_desconto = ctk.CTkLabel(f_costs, text=self.DISCOUNT_HINT, font=self.font_label)
+        self.lbl_desconto.grid(row=0, column=1, sticky="w", padx=5)
+        self.discount_hint_color = self.lbl_desconto.cget("text_color")  # restored after a parse error
 
-        self.entry_desconto = ctk.CTkEntry(f_costs, height=40, placeholder_text="-10% ou +500",
+        self.entry_desconto = ctk.CTkEntry(f_costs, height=40, placeholder_text="-10%, +500 ou -5% -200",
                                            fg_color=self.col_card, border_width=0)
         self.entry_desconto.grid(row=1, column=1, sticky="ew", padx=5, pady=(2, 10))
         self.entry_desconto.bind("<KeyRelease>", self.update_live_preview)
@@ -587,6 +623,10 @@ class App(ctk.CTk):
         ctk.CTkButton(self.frame_orc_preview, text="❌ Limpar / Cancelar", command=self.cancelar_edicao,
                       fg_color="#EF4444", hover_color="#DC2626").pack(side="bottom", padx=20, pady=(0, 5), fill="x")
 
+        # Hour-overrun risk (Monte Carlo over the historical dispersion of each service)
+        ctk.CTkButton(self.frame_orc_preview, text="🎲 Simular Risco de Horas", command=self.simular_risco,
+                      fg_color=self.col_bg, hover_color="#334155").pack(side="bottom", padx=20, pady=(0, 5), fill="x")
+
         # Load Data
         self.check_vars = []
         self.carregar_checkboxes_tarefas()
@@ -705,6 +745,10 @@ class App(ctk.CTk):
         ctk.CTkButton(header_right, text="🐑 Clonar", width=80, command=self.clonar_servico,
                       fg_color=self.col_card, hover_color=self.col_bg).pack(side="right")
 
+        # Profitability Ranking
+        ctk.CTkButton(header_right, text="🏆 Ranking", width=80, command=self.view_service_ranking,
+                      fg_color=self.col_card, hover_color=self.col_bg).pack(side="right", padx=(0, 10))
+
         colunas = ("id", "nome", "horas", "categoria", "tags", "uso")
         self.tree_cat = ttk.Treeview(frame_list, columns=colunas, show='headings')
         self.tree_cat.heading("id", text="ID")
@@ -768,6 +812,38 @@ class App(ctk.CTk):
         self.db.add_servico(novo_nome, float(vals[2]), vals[3], vals[4])
         self.refresh_catalogo()
 
+    def view_service_ranking(self):
+        win = ctk.CTkToplevel(self)
+        win.title("Ranking de Rentabilidade")
+        win.geometry("650x450")
+
+        combo_periodo = ctk.CTkComboBox(win, values=["Todos", "Este Mês", "Este Ano"],
+                                        fg_color=self.col_card, button_color=self.col_accent)
+        combo_periodo.set("Todos")
+        combo_periodo.pack(anchor="e", padx=10, pady=10)
+
+        cols = ("pos", "nome", "receita", "horas", "valor_hora")
+        tree = ttk.Treeview(win, columns=cols, show="headings")
+        tree.heading("pos", text="#")
+        tree.heading("nome", text="Serviço")
+        tree.heading("receita", text="Receita (R$)")
+        tree.heading("horas", text="Horas")
+        tree.heading("valor_hora", text="R$/h")
+        tree.column("pos", width=40)
+        tree.column("horas", width=70)
+        tree.column("valor_hora", width=90)
+        tree.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+
+        def carregar(periodo=None):
+            for row in tree.get_children():
+                tree.delete(row)
+            ranking = self.db.get_service_profitability_ranking(periodo or combo_periodo.get())
+            for pos, (nome, receita, horas, valor_hora) in enumerate(ranking, start=1):
+                tree.insert("", "end", values=(pos, nome, f"{receita or 0.0:.2f}", f"{horas:g}", f"{valor_hora:.2f}"))
+
+        combo_periodo.configure(command=carregar)
+        carregar()
+
     # --- ABA 4: CONFIGURAÇÕES FINANCEIRAS ---
     def create_tab_config(self):
         tab = self.tabview.tab("Config. Financeira")
@@ -836,6 +912,19 @@ class App(ctk.CTk):
         self.lbl_breakeven_val = ctk.CTkLabel(self.frame_breakeven, text="...", font=self.font_label, text_color="white")
         self.lbl_breakeven_val.pack(pady=(0, 10))
 
+        # -- Break-even Sensitivity (heatmap over a precomputed grid; sliders only re-slice it) --
+        frame_sens = ctk.CTkFrame(frame_params, fg_color=self.col_card, corner_radius=10)
+        frame_sens.pack(fill="x", padx=10, pady=10)
+        ctk.CTkLabel(frame_sens, text="Sensibilidade do Equilíbrio", font=self.font_subtitle).pack(pady=(10, 0))
+        self.sens_fig, self.sens_ax = plt.subplots(figsize=(4, 3), dpi=100)
+        self.sens_fig.patch.set_facecolor(self.col_card)
+        self.sens_canvas = FigureCanvasTkAgg(self.sens_fig, master=frame_sens)
+        self.sens_canvas.get_tk_widget().pack(fill="both", expand=True, padx=5, pady=5)
+        plt.close(self.sens_fig)
+        self.lbl_sens_val = ctk.CTkLabel(frame_sens, text="...", font=self.font_label, wraplength=320)
+        self.lbl_sens_val.pack(pady=(0, 10))
+        self.sensitivity = None
+
         # -- General Config --
         ctk.CTkLabel(frame_params, text="Parâmetros Gerais", font=self.font_subtitle).pack(pady=(20, 10))
 
@@ -850,6 +939,7 @@ class App(ctk.CTk):
         self.entry_horas = ctk.CTkEntry(frame_params, height=35, fg_color=self.col_card, border_width=0)
         self.entry_horas.insert(0, cfg[2])
         self.entry_horas.pack(padx=20, fill="x", pady=(0,10))
+        self.entry_horas.bind("<KeyRelease>", self.update_sensitivity_view)
 
         # Meta
         ctk.CTkLabel(frame_params, text="Meta de Faturamento Mensal (R$):", font=self.font_label).pack(anchor="w", padx=20)
@@ -971,11 +1061,8 @@ class App(ctk.CTk):
         val = pwd.get_input()
         if val == "admin":
             if messagebox.askyesno("CONFIRMAR", "Isso apagará TODAS as configurações financeiras e custos, restaurando o padrão. Projetos serão mantidos. Continuar?"):
-                # Reset Config
-                self.db.cursor.execute("DELETE FROM configuracoes")
-                self.db.cursor.execute("DELETE FROM custos_operacionais")
-                self.db.seed_data()
-                self.db.log_change("FACTORY RESET realizado.")
+                # Reset Config (one transaction; also drops the cached config/costs)
+                self.db.factory_reset()
 
                 # Refresh UI
                 self.refresh_custos_ui()
@@ -996,10 +1083,67 @@ class App(ctk.CTk):
             self.lbl_breakeven_val.configure(text="Impossível calcular (verifique margens)")
         else:
             self.lbl_breakeven_val.configure(text=f"Venda {int(hours)} horas (R$ {revenue:.2f}) para pagar as contas.")
+        self.rebuild_sensitivity_grid()
+
+    def rebuild_sensitivity_grid(self):
+        # Whole what-if grid in one pass (tax x profit x monthly hours x fixed-cost change), built
+        # only when saved costs/config change; slider moves just pick a slice of it
+        ctx = self.calc.get_contexto()
+        impostos = np.arange(0, 41, 1.0)                                # slider range
+        lucros = np.arange(0, 101, 2.0)                                 # slider range
+        horas = max(ctx.horas_mensais, 1) * np.linspace(0.5, 1.5, 9)    # around the saved hours
+        deltas = max(ctx.custos_fixos, 100) * np.linspace(-0.5, 0.5, 21)  # -50% .. +50% of fixed costs
+        preco_hora = self.db.get_sold_hourly_rate()
+        grid = self.calc.calcular_sensibilidade_equilibrio(impostos, lucros, horas, deltas, contexto=ctx, preco_hora=preco_hora)
+        self.sensitivity = (impostos, lucros, horas, deltas, grid, preco_hora > 0)
+        self.update_sensitivity_view()
+        self.sens_fig.tight_layout()  # axes/labels keep their layout across slider redraws
+
+    def update_sensitivity_view(self, _=None):
+        if self.sensitivity is None:
+            return
+        impostos, lucros, horas, deltas, grid, com_historico = self.sensitivity
+        try:
+            horas_atual = float(self.entry_horas.get())
+        except ValueError:
+            horas_atual = horas[len(horas) // 2]
+        i = int(np.abs(impostos - self.slider_imposto.get()).argmin())
+        j = int(np.abs(lucros - self.slider_lucro.get()).argmin())
+        k = int(np.abs(horas - horas_atual).argmin())
+        d0 = int(np.abs(deltas).argmin())
+
+        # Break-even hours by tax (x). With sales history the hour price is the sold average, so
+        # profit doesn't matter and y is the fixed-cost change; without it the price follows the
+        # costs, so y is the profit margin
+        if com_historico:
+            fatia, eixo_y, y_atual, titulo_y = grid["horas"][:, j, k, :], deltas, deltas[d0], "Variação custos fixos (R$)"
+        else:
+            fatia, eixo_y, y_atual, titulo_y = grid["horas"][:, :, k, d0], lucros, lucros[j], "Margem de lucro (%)"
+        fatia = np.where(fatia > 0, fatia, np.nan)
+        ax = self.sens_ax
+        ax.clear()
+        ax.set_facecolor(self.col_card)
+        ax.imshow(fatia.T, origin="lower", aspect="auto", cmap="RdYlGn_r",
+                  extent=(impostos[0], impostos[-1], eixo_y[0], eixo_y[-1]))
+        ax.plot(impostos[i], y_atual, marker="o", color="white", markeredgecolor="black")
+        ax.set_xlabel("Impostos (%)", color=self.col_text, fontsize=8)
+        ax.set_ylabel(titulo_y, color=self.col_text, fontsize=8)
+        ax.set_title("Horas para empatar", color="white", fontsize=9)
+        ax.tick_params(colors=self.col_text, labelsize=7)
+        self.sens_canvas.draw_idle()
+
+        h = grid["horas"][i, j, k, d0]
+        if h <= 0:
+            self.lbl_sens_val.configure(text="Com estes parâmetros não há como pagar as contas.")
+        else:
+            self.lbl_sens_val.configure(
+                text=f"Com {impostos[i]:.0f}% de imposto, {lucros[j]:.0f}% de lucro e {horas[k]:.0f} h/mês: "
+                     f"venda {int(h)} horas (R$ {grid['receita'][i, j, k, d0]:.2f}).")
 
     def update_slider_labels(self, _=None):
         self.lbl_imposto_val.configure(text=f"{int(self.slider_imposto.get())}%")
         self.lbl_lucro_val.configure(text=f"{int(self.slider_lucro.get())}%")
+        self.update_sensitivity_view()
 
     def update_tax_profile(self, choice):
         if choice == "MEI (0%)":
@@ -1014,7 +1158,7 @@ class App(ctk.CTk):
         filename = filedialog.asksaveasfilename(defaultextension=".db", filetypes=[("SQLite DB", "*.db")])
         if filename:
             try:
-                shutil.copy("meus_projetos.db", filename)
+                self.db.backup_to(filename)
                 messagebox.showinfo("Sucesso", "Backup realizado!")
             except Exception as e:
                 messagebox.showerror("Erro", str(e))
@@ -1024,9 +1168,9 @@ class App(ctk.CTk):
         if filename:
             if messagebox.askyesno("Cuidado", "Isso irá substituir todos os seus dados atuais. Continuar?"):
                 try:
-                    self.db.conn.close() # Close connection before overwrite
-                    shutil.copy(filename, "meus_projetos.db")
-                    # Reconnect
+                    self.db.restore_from(filename)
+                    # Reconnect (runs migrations if the backup is from an older version)
+                    self.db.close()
                     self.db = Database()
                     self.calc = CalculadoraPreco(self.db)
                     messagebox.showinfo("Sucesso", "Backup restaurado! O sistema será atualizado.")
@@ -1038,22 +1182,83 @@ class App(ctk.CTk):
         filename = filedialog.askopenfilename(filetypes=[("CSV Files", "*.csv")])
         if not filename: return
 
-        try:
+        def job(progress):
             with open(filename, newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                count = 0
-                for row in reader:
-                    # Expect headers: Nome, Horas, Categoria
-                    nome = row.get("Nome", row.get("nome"))
-                    horas = row.get("Horas", row.get("horas"))
-                    cat = row.get("Categoria", row.get("categoria", "Geral"))
-                    if nome and horas:
-                        self.db.add_servico(nome, float(horas), cat)
-                        count += 1
-            messagebox.showinfo("Sucesso", f"{count} serviços importados!")
+                # Expect headers: Nome, Horas, Categoria (Tags optional)
+                rows = ((row.get("Nome", row.get("nome")), row.get("Horas", row.get("horas")),
+                         row.get("Categoria", row.get("categoria")), row.get("Tags", row.get("tags")))
+                        for row in csv.DictReader(csvfile))
+                return self.db.bulk_import_servicos(rows, progress=progress)
+
+        def done(result):
+            inseridos, atualizados, ignorados = result
+            messagebox.showinfo("Sucesso", f"{inseridos} serviços importados, {atualizados} atualizados"
+                                           f"{f', {ignorados} linhas inválidas ignoradas' if ignorados else ''}!")
             self.refresh_catalogo()
-        except Exception as e:
-            messagebox.showerror("Erro", f"Erro ao importar: {e}")
+
+        self.run_import("Importando Catálogo", job, done)
+
+    def importar_projetos(self):
+        filename = filedialog.askopenfilename(filetypes=[("Projetos (CSV/NDJSON)", "*.csv *.ndjson *.jsonl"), ("Todos", "*.*")])
+        if not filename: return
+
+        def done(result):
+            projetos, tarefas, ignorados = result
+            messagebox.showinfo("Sucesso", f"{projetos} projetos e {tarefas} tarefas importados"
+                                           f"{f', {ignorados} projetos inválidos ignorados' if ignorados else ''}!")
+            self.refresh_projetos()
+            self.update_dashboard()
+
+        self.run_import("Importando Projetos",
+                        lambda progress: self.db.bulk_import_projects(read_projects(filename), progress=progress), done)
+
+    def run_import(self, title, job, on_done):
+        # Runs job(progress) on a worker thread (own DB connection) behind a progress window
+        win = ctk.CTkToplevel(self)
+        win.title(title)
+        win.geometry("350x130")
+        win.transient(self)
+        win.grab_set()
+
+        lbl = ctk.CTkLabel(win, text="Lendo arquivo...", font=self.font_label)
+        lbl.pack(pady=(20, 10))
+        bar = ctk.CTkProgressBar(win, mode="indeterminate", progress_color=self.col_accent)
+        bar.pack(fill="x", padx=20)
+        bar.start()
+
+        events = queue.Queue()
+
+        def worker():
+            try:
+                events.put(("done", job(lambda n: events.put(("progress", n)))))
+            except Exception as e:
+                events.put(("error", e))
+            finally:
+                self.db.release_connection()
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.after(100, lambda: self._poll_import(win, lbl, events, on_done))
+
+    def _poll_import(self, win, lbl, events, on_done):
+        # Runs on the Tk thread: widgets are only touched here
+        while True:
+            try:
+                kind, payload = events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "progress":
+                lbl.configure(text=f"{payload} registros processados...")
+                continue
+
+            win.destroy()
+            if kind == "done":
+                on_done(payload)
+            else:
+                messagebox.showerror("Erro", f"Erro ao importar: {payload}")
+            return
+
+        self.after(100, lambda: self._poll_import(win, lbl, events, on_done))
 
     def exportar_csv(self):
         filename = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV Files", "*.csv")])
@@ -1177,23 +1382,60 @@ class App(ctk.CTk):
         query = self.entry_search.get()
         sort_by = self.combo_sort.get()
 
-        # Fetch from DB using the new method
-        projects = self.db.search_projects(query, sort_by)
-
-        # Calculate Total
-        total = sum(p[4] for p in projects) # index 4 is preco_final
-        self.lbl_filtered_total.configure(text=f"Total Filtrado: R$ {total:.2f}")
+        # Total comes from an aggregate; only the first page of rows is fetched
+        try:
+            count, total = self.db.get_search_summary(query)
+            self.loaded_projects, self.projects_cursor = self.db.search_projects_page(query, sort_by, limit=self.PAGE_SIZE)
+        except SearchQueryError as e:
+            # Keep the current list while the filter is being typed
+            self.lbl_filtered_total.configure(text=f"⚠ {e}", text_color="#EF4444")
+            return
+        self.lbl_filtered_total.configure(text=f"Total Filtrado: R$ {total:.2f} ({count} projetos)", text_color=self.col_success)
+        # Query/sort the count, rows and cursor came from: "select all" deletes exactly this search
+        # and "Carregar mais" pages it, whatever is typed in the box afterwards
+        self.projects_query, self.projects_sort, self.filtered_count = query, sort_by, count
 
         # Reset Selection
         self.selected_project_ids = []
+        self.select_all_matching = False
         if hasattr(self, 'frame_batch'):
             self.frame_batch.pack_forget()
 
         # Render
         if self.view_mode == "Lista":
-            self.render_list_view(projects)
+            self.render_list_view(self.loaded_projects)
         else:
-            self.render_kanban_view(projects)
+            self.render_kanban_view(self.loaded_projects)
+        self.render_load_more()
+
+    def load_more_projetos(self):
+        if self.projects_cursor is None: return
+
+        page, self.projects_cursor = self.db.search_projects_page(
+            self.projects_query, self.projects_sort, limit=self.PAGE_SIZE, after=self.projects_cursor)
+        self.loaded_projects.extend(page)
+
+        if self.view_mode == "Lista":
+            self.btn_load_more.destroy()
+            for proj in page:
+                self.create_project_row(self.scroll_projects, proj)
+        else:
+            # Kanban columns are regrouped from everything loaded so far
+            self.render_kanban_view(self.loaded_projects)
+        self.render_load_more()
+
+    def render_load_more(self):
+        if self.projects_cursor is None: return
+
+        btn_parent = self.scroll_projects
+        if self.view_mode == "Kanban":
+            # Below the 4 status columns
+            btn_parent = ctk.CTkFrame(self.scroll_projects, fg_color="transparent")
+            btn_parent.grid(row=1, column=0, columnspan=4, sticky="ew")
+
+        self.btn_load_more = ctk.CTkButton(btn_parent, text="⬇ Carregar mais", command=self.load_more_projetos,
+                                           fg_color=self.col_card, hover_color=self.col_bg)
+        self.btn_load_more.pack(pady=10)
 
     def render_list_view(self, projects):
         # Clear existing
@@ -1215,7 +1457,7 @@ class App(ctk.CTk):
         card.pack(fill="x", pady=5)
 
         # 1. Checkbox
-        var_chk = ctk.BooleanVar(value=pid in self.selected_project_ids)
+        var_chk = ctk.BooleanVar(value=self.select_all_matching or pid in self.selected_project_ids)
         chk = ctk.CTkCheckBox(card, text="", width=24, variable=var_chk,
                               command=lambda p=pid, v=var_chk: self.on_project_select(p, v))
         chk.pack(side="left", padx=(15, 5), pady=10)
@@ -1241,15 +1483,11 @@ class App(ctk.CTk):
         pill = ctk.CTkLabel(card, text=status, fg_color=bg_col, text_color="white",
                             corner_radius=15, width=100, height=30, font=ctk.CTkFont(weight="bold"))
         pill.pack(side="left", padx=10)
-        pill.bind("<Button-1>", lambda e: self.alterar_status(pid, status)) # Click to change
+        pill.bind("<Button-1>", lambda e: self.alterar_status([pid], status)) # Click to change
 
         # 4. Days Open / Alert
-        # Calculate days
-        try:
-            dt_update = datetime.strptime(atualizado, "%Y-%m-%d %H:%M:%S")
-            days_diff = (datetime.now() - dt_update).days
-        except:
-            days_diff = 0
+        # Calculate days (atualizado already comes as a datetime)
+        days_diff = (datetime.now() - atualizado).days if atualizado else 0
 
         days_txt = f"{days_diff}d"
         days_col = self.col_text_muted
@@ -1284,6 +1522,11 @@ class App(ctk.CTk):
         btn_del.pack(side="left", padx=2)
 
     def on_project_select(self, pid, var):
+        if self.select_all_matching:
+            # Unchecking one row drops back to an explicit selection of the loaded rows
+            self.select_all_matching = False
+            self.selected_project_ids = [p[0] for p in self.loaded_projects]
+
         if var.get():
             if pid not in self.selected_project_ids:
                 self.selected_project_ids.append(pid)
@@ -1291,13 +1534,34 @@ class App(ctk.CTk):
             if pid in self.selected_project_ids:
                 self.selected_project_ids.remove(pid)
 
+        self.update_batch_bar()
+
+    def update_batch_bar(self):
         # Update Batch Bar Visibility
-        if self.selected_project_ids:
+        if self.select_all_matching:
+            self.lbl_batch_count.configure(text=f"Todos os {self.filtered_count} projetos da busca selecionados")
+            self.btn_select_all.pack_forget()
+            self.frame_batch.pack(fill="x", padx=10, pady=(0, 10), before=self.scroll_projects)
+        elif self.selected_project_ids:
             self.lbl_batch_count.configure(text=f"{len(self.selected_project_ids)} selecionados")
+            if self.filtered_count > len(self.selected_project_ids):
+                self.btn_select_all.configure(text=f"Selecionar todos ({self.filtered_count})")
+                self.btn_select_all.pack(side="right", padx=10, pady=5)
+            else:
+                self.btn_select_all.pack_forget()
             self.frame_batch.pack(fill="x", padx=10, pady=(0, 10), before=self.scroll_projects)
         else:
             self.frame_batch.pack_forget()
 
+    def select_all_projects(self):
+        self.select_all_matching = True
+        self.selected_project_ids = []
+        self.update_batch_bar()
+        # Re-check the rows already on screen (list view is the one with checkboxes)
+        if self.view_mode == "Lista":
+            self.render_list_view(self.loaded_projects)
+            self.render_load_more()
+
     def render_kanban_view(self, projects):
         for w in self.scroll_projects.winfo_children(): w.destroy()
 
@@ -1352,10 +1616,7 @@ class App(ctk.CTk):
         footer.pack(fill="x", padx=10, pady=5)
 
         # Days
-        try:
-            dt_update = datetime.strptime(atualizado, "%Y-%m-%d %H:%M:%S")
-            days_diff = (datetime.now() - dt_update).days
-        except: days_diff = 0
+        days_diff = (datetime.now() - atualizado).days if atualizado else 0
 
         d_col = self.col_text_muted
         if days_diff > 10 and status != "Concluído": d_col = "#EF4444"
@@ -1366,7 +1627,7 @@ class App(ctk.CTk):
         ctk.CTkButton(footer, text="✏️", width=25, height=25, fg_color="transparent", hover_color=self.col_bg,
                       command=lambda: self.editar_projeto(pid)).pack(side="right")
 
-    def alterar_status(self, proj_id, current_status):
+    def alterar_status(self, proj_ids, current_status):
         # Janela Modal Simples
         dialog = ctk.CTkToplevel(self)
         dialog.title("Alterar Status")
@@ -1378,25 +1639,25 @@ class App(ctk.CTk):
 
         status_options = ["Orçamento", "Aprovado", "Em Execução", "Concluído"]
         combo = ctk.CTkComboBox(dialog, values=status_options)
-        combo.set(current_status)
+        combo.set(current_status or status_options[0])
         combo.pack(pady=5)
 
         def confirm():
-            new_status = combo.get()
-            now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.db.cursor.execute("UPDATE projetos SET status=?, data_atualizacao=? WHERE id=?", (new_status, now_str, proj_id))
-            self.db.conn.commit()
+            # One transaction for all ids; each change is logged in status_historico
+            changed = self.db.set_status(proj_ids, combo.get())
             self.refresh_projetos()
             dialog.destroy()
-            messagebox.showinfo("Sucesso", "Status atualizado!")
+            if len(proj_ids) == 1:
+                messagebox.showinfo("Sucesso", "Status atualizado!")
+            else:
+                messagebox.showinfo("Sucesso", f"Status atualizado em {changed} projetos!")
 
         ctk.CTkButton(dialog, text="Salvar", command=confirm,
                       fg_color="#2CC985", hover_color="#25A970").pack(pady=15)
 
     def gerar_pdf(self, proj_id):
         # Fetch Data
-        self.db.cursor.execute("SELECT * FROM projetos WHERE id=?", (proj_id,))
-        proj = self.db.cursor.fetchone() # id, cliente, data_criacao, data_entrega, status, extras, preco
+        proj = self.db.get_project(proj_id) # id, cliente, data_criacao, data_entrega, status, extras, preco
 
         cliente = proj[1]
         extras = proj[5]
@@ -1500,6 +1761,7 @@ class App(ctk.CTk):
         filter_cat = self.combo_cat_filter.get()
         search_txt = self.entry_cat_search.get().lower()
         servicos = self.db.get_servicos()
+        usage_counts = self.db.get_service_usage_counts()
 
         # Update Most Profitable
         prof_name, prof_rev = self.db.get_most_profitable_service()
@@ -1527,7 +1789,7 @@ class App(ctk.CTk):
             cat_display = f"{icon} {cat}" if icon else cat
 
             # Usage
-            usage = self.db.get_service_usage_count(nome)
+            usage = usage_counts.get(id_s, 0)
 
             self.tree_cat.insert("", "end", values=(id_s, nome, horas, cat_display, tags, usage))
 
@@ -1556,7 +1818,7 @@ class App(ctk.CTk):
             nome_servico = item['values'][1]
 
             # Validation
-            usage = self.db.get_service_usage_count(nome_servico)
+            usage = self.db.get_service_usage_count(int(id_servico))
             if usage > 0:
                 messagebox.showerror("Bloqueado", f"O serviço '{nome_servico}' está em uso em {usage} tarefas de projetos. Não pode ser excluído por segurança.")
                 return
@@ -1604,7 +1866,13 @@ class App(ctk.CTk):
 
         discount_str = self.entry_desconto.get()
 
-        res = self.calc.calcular_orcamento(horas_totais, extras, discount_str)
+        try:
+            res = self.calc.calcular_orcamento(horas_totais, extras, discount_str)
+        except DiscountError as e:
+            # Keep the last preview while the discount is being typed
+            self.lbl_desconto.configure(text=f"⚠ {e}", text_color="#EF4444")
+            return
+        self.lbl_desconto.configure(text=self.DISCOUNT_HINT, text_color=self.discount_hint_color)
         # res: valor_hora, custo_producao, preco_sugerido, preco_final, lucro_liquido_real, margem_real_pct, impostos_reais, dias_uteis
 
         # Update UI Labels
@@ -1648,6 +1916,36 @@ class App(ctk.CTk):
         # Auto-save Draft
         self.save_draft(ids_selecionados)
 
+    def simular_risco(self):
+        tarefas = [(horas, sid) for var, horas, nome, sid in self.check_vars if var.get()]
+        if not tarefas:
+            messagebox.showwarning("Atenção", "Selecione pelo menos uma tarefa.")
+            return
+
+        try:
+            extras = float(self.entry_extras.get())
+        except:
+            extras = 0.0
+
+        try:
+            res = self.calc.simular_orcamento(tarefas, extras, self.entry_desconto.get())
+        except DiscountError as e:
+            messagebox.showerror("Erro", f"Desconto inválido: {e}")
+            return
+
+        m, h = res['margem_percentis'], res['horas_percentis']
+        fontes = res['fontes_dispersao']
+        if "servico" in fontes or "geral" in fontes:
+            origem = f"Variação histórica: {fontes.get('servico', 0)} de {len(tarefas)} tarefas com histórico próprio."
+        else:
+            origem = f"Sem histórico de variação de horas: usando dispersão padrão de {SIM_SIGMA_PADRAO:.0%}."
+        messagebox.showinfo("Risco de Horas", (
+            f"Preço: R$ {res['preco_final']:.2f} | Margem prevista: {res['margem_prevista']:.1f}%\n\n"
+            f"Probabilidade de prejuízo: {res['prob_prejuizo'] * 100:.1f}%\n"
+            f"Margem média: {res['margem_media']:.1f}%\n"
+            f"Margem (pior 5% / mediana / melhor 5%): {m[5]:.1f}% / {m[50]:.1f}% / {m[95]:.1f}%\n"
+            f"Horas (mediana / 95%): {h[50]:.0f}h / {h[95]:.0f}h\n\n{origem}"))
+
     def save_draft(self, ids):
         data = {
             "cliente": self.combo_cliente.get(),
@@ -1748,25 +2046,13 @@ class App(ctk.CTk):
         desconto_txt = self.entry_desconto.get()
 
         try:
-            data_entrega = self.entry_data.get_date().strftime("%d/%m/%Y")
+            data_entrega = self.entry_data.get_date()
         except:
-            data_entrega = ""
-
-        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        self.db.cursor.execute("""
-            INSERT INTO projetos (cliente, data_criacao, data_entrega, status, custo_extras, preco_final, categoria, data_atualizacao, desconto_texto)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (cliente, datetime.now().strftime("%Y-%m-%d"), data_entrega, "Orçamento", extras, preco_final, categoria, now_str, desconto_txt))
+            data_entrega = None
 
-        proj_id = self.db.cursor.lastrowid
-
-        for var, horas, nome, sid in self.check_vars:
-            if var.get():
-                self.db.cursor.execute("INSERT INTO tarefas_projeto (projeto_id, descricao, horas_estimadas) VALUES (?, ?, ?)",
-                                       (proj_id, nome, horas))
+        # Project + tasks in one transaction; Database converts to the stored format
+        self.db.add_project(cliente, data_entrega, extras, preco_final, categoria, desconto_txt, self.selected_tasks())
 
-        self.db.conn.commit()
         self._post_save_actions("Projeto Criado!")
 
     def atualizar_projeto_db(self, preco_final, extras):
@@ -1775,27 +2061,20 @@ class App(ctk.CTk):
         desconto_txt = self.entry_desconto.get()
 
         try:
-            data_entrega = self.entry_data.get_date().strftime("%d/%m/%Y")
+            data_entrega = self.entry_data.get_date()
         except:
-            data_entrega = ""
+            data_entrega = None
 
-        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Update + recreate tasks in one transaction
+        self.db.update_project(self.editing_project_id, cliente, data_entrega, extras, preco_final, categoria,
+                               desconto_txt, self.selected_tasks())
 
-        self.db.cursor.execute("""
-            UPDATE projetos SET cliente=?, data_entrega=?, custo_extras=?, preco_final=?, categoria=?, data_atualizacao=?, desconto_texto=?
-            WHERE id=?
-        """, (cliente, data_entrega, extras, preco_final, categoria, now_str, desconto_txt, self.editing_project_id))
-
-        # Recreate tasks
-        self.db.cursor.execute("DELETE FROM tarefas_projeto WHERE projeto_id=?", (self.editing_project_id,))
-        for var, horas, nome, sid in self.check_vars:
-            if var.get():
-                self.db.cursor.execute("INSERT INTO tarefas_projeto (projeto_id, descricao, horas_estimadas) VALUES (?, ?, ?)",
-                                       (self.editing_project_id, nome, horas))
-
-        self.db.conn.commit()
         self._post_save_actions("Projeto Atualizado!")
 
+    def selected_tasks(self):
+        # Checked catalog services as (description, hours, service id)
+        return [(nome, horas, sid) for var, horas, nome, sid in self.check_vars if var.get()]
+
     def _post_save_actions(self, msg):
         # Clear Draft
         if os.path.exists("draft.json"):
@@ -1822,8 +2101,7 @@ class App(ctk.CTk):
         self.tabview.set("Meus Projetos")
 
     def editar_projeto(self, pid):
-        self.db.cursor.execute("SELECT * FROM projetos WHERE id=?", (pid,))
-        proj = self.db.cursor.fetchone() # id, cliente, data_criacao, data_entrega, status, extras, preco, categoria
+        proj = self.db.get_project(pid) # id, cliente, data_criacao, data_entrega, status, extras, preco, categoria
 
         # Switch to Tab 3
         self.tabview.set("Novo Orçamento")
@@ -1848,21 +2126,14 @@ class App(ctk.CTk):
 
         if proj[3] and hasattr(self.entry_data, 'set_date'):
             try:
-                dt = datetime.strptime(proj[3], "%d/%m/%Y")
-                self.entry_data.set_date(dt)
+                self.entry_data.set_date(proj[3])
             except: pass
 
-        # Select Tasks
-        self.db.cursor.execute("SELECT descricao FROM tarefas_projeto WHERE projeto_id=?", (pid,))
-        tarefas = [t[0] for t in self.db.cursor.fetchall()]
+        # Select Tasks (by catalog id, so renamed services are still restored)
+        servicos_projeto = self.db.get_project_service_ids(pid)
 
         for var, horas, nome, sid in self.check_vars:
-            # We match by name/description since we didn't store service_id in tarefas_projeto originally.
-            # Ideally we should match by name.
-            if nome in tarefas:
-                var.set(True)
-            else:
-                var.set(False)
+            var.set(sid in servicos_projeto)
 
         self.update_live_preview()
         messagebox.showinfo("Modo Edição", f"Editando Projeto #{pid}")
@@ -1874,17 +2145,14 @@ class App(ctk.CTk):
 
     def excluir_projeto(self, pid):
         if messagebox.askyesno("Confirmar", "Excluir permanentemente este projeto?"):
-            self.db.cursor.execute("DELETE FROM tarefas_projeto WHERE projeto_id=?", (pid,))
-            self.db.cursor.execute("DELETE FROM projetos WHERE id=?", (pid,))
-            self.db.conn.commit()
+            self.db.delete_projects([pid])
             self.refresh_projetos()
             # Update Dashboard if needed
             self.update_dashboard()
 
     def open_project_details(self, pid):
         # Modal View
-        self.db.cursor.execute("SELECT * FROM projetos WHERE id=?", (pid,))
-        proj = self.db.cursor.fetchone()
+        proj = self.db.get_project(pid)
 
         self.db.cursor.execute("SELECT descricao, horas_estimadas FROM tarefas_projeto WHERE projeto_id=?", (pid,))
         tarefas = self.db.cursor.fetchall()